@@ -0,0 +1,186 @@
+"""
+静态资源指纹与预压缩
+
+`flask --app app assets build` 把 static/ 下的文件复制为带内容哈希的文件名（css/style.css ->
+build/css/style.<hash>.css），为文本文件离线生成 .gz / .br 兄弟文件，并写出 manifest.json。
+应用启动时读取 manifest，url_for('static', filename='css/style.css') 自动改写为带哈希的路径。
+
+文件名里带内容哈希的资源（构建产物和按内容哈希保存的上传图片）内容永远不变，
+返回一年的 Cache-Control: immutable；其余静态文件沿用 Flask 默认的处理。
+没有构建过（开发环境）时一切照旧。
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+import compression
+
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 10
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# ImagePipeline 保存的原图和变体：{sha256 前 32 位}.ext 或 {sha256 前 32 位}_{变体}.ext
+HASHED_UPLOAD = re.compile(r'^[0-9a-f]{32}(_[a-z0-9_]+)?\.[a-z0-9]+$')
+
+assets_cli = AppGroup('assets', help='静态资源构建')
+
+
+class StaticAssets:
+    """按 manifest 改写静态资源 URL，并为带哈希的资源返回长期缓存和预压缩内容"""
+
+    def __init__(self, app=None):
+        self.paths = {}
+        self.encodings = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        ASSETS_MAX_AGE: 带哈希资源的缓存秒数，默认一年
+        """
+        self.static_folder = app.static_folder
+        self.max_age = int(app.config.get('ASSETS_MAX_AGE', 365 * 24 * 3600))
+        uploads = os.path.relpath(os.path.abspath(app.config['UPLOAD_FOLDER']), app.static_folder)
+        self.uploads = uploads.replace(os.sep, '/')
+        self.load()
+        app.extensions['static_assets'] = self
+        app.url_defaults(self._fingerprint)
+        if app.has_static_folder:
+            app.view_functions['static'] = self.send_static
+
+    def load(self):
+        """读取构建时写出的 manifest；不存在时不改写任何 URL"""
+        path = os.path.join(self.static_folder, BUILD_DIR, MANIFEST_NAME)
+        try:
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        self.paths = {source: entry['path'] for source, entry in manifest.items()}
+        self.encodings = {entry['path']: tuple(entry['encodings']) for entry in manifest.values()}
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.paths.get(values['filename'], values['filename'])
+
+    def immutable(self, filename):
+        if filename in self.encodings:
+            return True
+        directory, _, name = filename.rpartition('/')
+        return directory == self.uploads and HASHED_UPLOAD.match(name) is not None
+
+    def send_static(self, filename):
+        if not self.immutable(filename):
+            return current_app.send_static_file(filename)
+        available = self.encodings.get(filename, ())
+        encoding = compression.negotiate(request.accept_encodings, available) if available else None
+        response = send_from_directory(
+            self.static_folder,
+            filename + ENCODING_SUFFIXES[encoding] if encoding else filename,
+            mimetype=mimetypes.guess_type(filename)[0],
+            max_age=self.max_age,
+            # 发送的是 .gz/.br 文件，Content-Disposition 里的文件名仍用请求的资源名
+            download_name=os.path.basename(filename),
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        if available:
+            compression.add_vary(response)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def fingerprinted_name(path, digest):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _write(path, data):
+    """先写临时文件再改名，正在运行的 worker 不会读到写了一半的文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def source_files(static_folder, exclude):
+    """static/ 下需要构建的文件（相对路径，/ 分隔），跳过构建目录、上传目录和隐藏文件"""
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder).replace(os.sep, '/')
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and rel_root + d not in exclude)
+        for name in sorted(files):
+            if not name.startswith('.'):
+                yield rel_root + name
+
+
+def build(static_folder, exclude=(), encodings=None, prune=False):
+    """
+    生成带哈希的资源、预压缩文件和 manifest
+
+    Args:
+        exclude: 不参与构建的目录（相对 static_folder），构建目录本身总是跳过
+        encodings: 预压缩的编码，默认为 compression.available_encodings()
+        prune: 删除构建目录中不在新 manifest 里的旧文件。滚动发布时旧页面仍会引用旧文件，
+            等旧 worker 和页面缓存都过期后再清理
+
+    Returns:
+        [(源文件, 带哈希的路径, {编码: 字节数}, 原始字节数)]
+    """
+    encodings = compression.available_encodings() if encodings is None else encodings
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    manifest, results = {}, []
+    for source in source_files(static_folder, set(exclude) | {BUILD_DIR}):
+        with open(os.path.join(static_folder, source), 'rb') as f:
+            data = f.read()
+        target = f"{BUILD_DIR}/{fingerprinted_name(source, hashlib.sha256(data).hexdigest())}"
+        target_path = os.path.join(static_folder, target)
+        if not os.path.exists(target_path):
+            _write(target_path, data)
+        sizes = {}
+        if compression.compressible(mimetypes.guess_type(source)[0], len(data), 0):
+            for encoding in encodings:
+                compressed = compression.compress(data, encoding, best=True)
+                # 图片等已经压缩过的内容再压缩往往更大，这时不生成
+                if len(compressed) < len(data):
+                    _write(target_path + ENCODING_SUFFIXES[encoding], compressed)
+                    sizes[encoding] = len(compressed)
+        manifest[source] = {'path': target, 'encodings': list(sizes)}
+        results.append((source, target, sizes, len(data)))
+    _write(os.path.join(build_root, MANIFEST_NAME),
+           json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8'))
+    if prune:
+        keep = {os.path.join(build_root, MANIFEST_NAME)}
+        for entry in manifest.values():
+            path = os.path.join(static_folder, entry['path'])
+            keep.add(path)
+            keep.update(path + ENCODING_SUFFIXES[encoding] for encoding in entry['encodings'])
+        for root, _, files in os.walk(build_root):
+            for name in files:
+                path = os.path.join(root, name)
+                if path not in keep:
+                    os.remove(path)
+    return results
+
+
+@assets_cli.command('build')
+@click.option('--prune', is_flag=True, help='删除旧的构建产物')
+def build_command(prune):
+    """为静态资源生成带哈希的文件名和 gzip/br 预压缩文件"""
+    assets = current_app.extensions['static_assets']
+    results = build(assets.static_folder, exclude=[assets.uploads], prune=prune)
+    total = {'identity': 0}
+    for source, target, sizes, size in results:
+        total['identity'] += size
+        for encoding, compressed in sizes.items():
+            total[encoding] = total.get(encoding, 0) + compressed
+        detail = ', '.join(f"{encoding} {compressed}" for encoding, compressed in sizes.items())
+        click.echo(f"{source} -> {target} ({size} 字节{'; ' + detail if detail else ''})")
+    click.echo(f"共 {len(results)} 个文件：" + ', '.join(f"{name} {size} 字节" for name, size in total.items()))
+    assets.load()
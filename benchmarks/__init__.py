@@ -0,0 +1 @@
+"""TravelHub 性能基准脚本，使用本地 SQLite 数据集，不依赖 MySQL"""
@@ -0,0 +1,87 @@
+"""
+JSON 接口的字节数和 CPU 基准
+
+对 /api/resorts 的一页数据，分别测量每个请求的响应字节数和 CPU 时间（time.process_time）：
+
+- 未命中缓存，标准库 json 编码 / orjson 编码
+- 命中缓存，不压缩 / gzip / br（安装了 brotli 时）
+- 带 If-None-Match 的 304
+- fields= 只取卡片需要的几个字段
+
+通过 Flask test client 在进程内调用，需要先用 benchmarks.seed 生成数据。
+
+用法：
+    python -m benchmarks.seed --database sqlite:///bench.db --reset
+    python -m benchmarks.api --database sqlite:///bench.db --limit 50
+"""
+import argparse
+import time
+from flask.json.provider import DefaultJSONProvider
+
+import compression
+from benchmarks.load import load_test_app
+from json_provider import OrjsonProvider, orjson
+
+
+def measure(client, path, repeat, headers=None, before=None):
+    """
+    Returns:
+        (状态码, 响应字节数, 每个请求的 CPU 毫秒数)
+    """
+    status, size, cpu = None, 0, 0.0
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.process_time()
+        response = client.get(path, headers=headers)
+        body = response.get_data()
+        cpu += time.process_time() - start
+        status, size = response.status_code, len(body)
+        response.close()
+    return status, size, cpu / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--limit', type=int, default=50, help='每页度假村数')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    app = load_test_app(args.database, 'memory')
+    from app import response_cache
+    client = app.test_client()
+    path = f'/api/resorts?limit={args.limit}'
+    slim = f'{path}&fields=id,resort_name,country,city,picture,avg_score'
+    miss = lambda: response_cache.invalidate('ranking')
+
+    rows = []
+    for name, provider in (('stdlib json', DefaultJSONProvider), ('orjson', OrjsonProvider if orjson else None)):
+        if provider is None:
+            print(f"未安装 orjson，跳过 {name}")
+            continue
+        app.json = provider(app)
+        rows.append((f'miss, {name}', *measure(client, path, args.repeat, before=miss)))
+    # 之后的场景使用应用默认的编码器
+    app.json = OrjsonProvider(app) if orjson else DefaultJSONProvider(app)
+
+    status, _, _ = measure(client, path, 1)
+    assert status == 200, status
+    rows.append(('hit, identity', *measure(client, path, args.repeat)))
+    for encoding in compression.available_encodings():
+        rows.append((f'hit, {encoding}', *measure(client, path, args.repeat, {'Accept-Encoding': encoding})))
+    etag = client.get(path, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    rows.append(('304 not modified', *measure(client, path, args.repeat,
+                                               {'Accept-Encoding': 'gzip', 'If-None-Match': etag})))
+    rows.append(('fields=, identity', *measure(client, slim, args.repeat)))
+    rows.append(('fields=, gzip', *measure(client, slim, args.repeat, {'Accept-Encoding': 'gzip'})))
+
+    baseline_bytes, baseline_cpu = rows[0][2], rows[0][3]
+    print(f"GET {path}，每个场景 {args.repeat} 次")
+    print(f"{'scenario':<20} {'status':>6} {'bytes':>8} {'vs miss':>8} {'cpu ms':>8} {'vs miss':>8}")
+    for name, status, size, cpu in rows:
+        print(f"{name:<20} {status:>6} {size:>8} {size / baseline_bytes:>7.0%} {cpu:>8.3f} {cpu / baseline_cpu:>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+TravelHub 压测脚本
+
+依次压测首页、排行接口、度假村详情、登录和提交评论，统计每个场景的
+p50/p95/p99 延迟和吞吐量，结果写成 JSON，可以与之前提交的结果对比。
+
+两种模式：
+- 默认通过 Flask test client 在进程内调用（需要 --database，先用 benchmarks.seed 生成数据）
+- 指定 --url 时通过 HTTP 压测已经启动的服务（如 gunicorn）
+
+用法：
+    python -m benchmarks.seed --database sqlite:///bench.db --reset
+    python -m benchmarks.load --database sqlite:///bench.db --output bench.json
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 8 --compare bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+
+from benchmarks.seed import BENCH_PASSWORD
+
+SCENARIOS = ('home', 'api_resorts', 'resort_detail', 'login', 'review_post')
+
+
+class TestClient:
+    """进程内调用 Flask 应用"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    """通过 HTTP 访问已启动的服务，带 cookie 以保持登录状态"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def percentile(sorted_values, pct):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class Runner:
+    def __init__(self, make_client, requests, concurrency, warmup, login_users, seed):
+        self.make_client = make_client
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.login_users = login_users
+        self.seed = seed
+        self.resort_ids = []
+
+    def discover(self):
+        """通过排行接口取一批度假村 id 供详情页和评论场景使用"""
+        client = self.make_client()
+        cursor = ''
+        while cursor is not None and len(self.resort_ids) < 2000:
+            status, body = client.request('GET', f'/api/resorts?limit=100&cursor={urllib.parse.quote(cursor)}')
+            if status != 200:
+                raise RuntimeError(f"/api/resorts 返回 {status}")
+            data = json.loads(body)
+            self.resort_ids.extend(item['id'] for item in data['items'])
+            cursor = data['next_cursor']
+        if not self.resort_ids:
+            raise RuntimeError("数据库中没有度假村，请先运行 python -m benchmarks.seed")
+
+    def _login(self, client, rng):
+        username = f'bench_user_{rng.randrange(self.login_users)}'
+        return client.request('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+
+    def _worker(self, scenario, count, worker_index, latencies, errors):
+        rng = random.Random(self.seed * 1000 + worker_index)
+        client = self.make_client()
+        if scenario == 'review_post':
+            self._login(client, rng)
+        cursor = ''
+        for i in range(count + self.warmup):
+            if scenario == 'home':
+                method, path, data, ok = 'GET', '/', None, (200,)
+            elif scenario == 'api_resorts':
+                # 沿着游标逐页翻，翻到底后从第一页重新开始
+                method, path, data, ok = 'GET', f'/api/resorts?cursor={urllib.parse.quote(cursor)}', None, (200,)
+            elif scenario == 'resort_detail':
+                method, path, data, ok = 'GET', f'/resort/{rng.choice(self.resort_ids)}', None, (200,)
+            elif scenario == 'login':
+                method, path, ok = 'POST', '/login', (302,)
+                data = {'username': f'bench_user_{rng.randrange(self.login_users)}', 'password': BENCH_PASSWORD}
+            else:
+                method, path, ok = 'POST', f'/resort/{rng.choice(self.resort_ids)}', (302,)
+                data = {'recommendation': rng.randint(1, 10), 'expenditure': rng.randint(100, 5000), 'comment': 'bench'}
+            start = time.perf_counter()
+            try:
+                status, body = client.request(method, path, data)
+            except Exception:
+                status, body = None, b''
+            elapsed = time.perf_counter() - start
+            if scenario == 'api_resorts' and status == 200:
+                cursor = json.loads(body)['next_cursor'] or ''
+            if i < self.warmup:
+                continue
+            latencies.append(elapsed)
+            if status not in ok:
+                errors.append(status)
+
+    def run_scenario(self, scenario):
+        latencies, errors = [], []
+        per_worker = [self.requests // self.concurrency] * self.concurrency
+        for i in range(self.requests % self.concurrency):
+            per_worker[i] += 1
+        threads = [
+            threading.Thread(target=self._worker, args=(scenario, count, index, latencies, errors))
+            for index, count in enumerate(per_worker)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        latencies.sort()
+        ms = [value * 1000 for value in latencies]
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'mean_ms': round(sum(ms) / len(ms), 3) if ms else None,
+            'p50_ms': round(percentile(ms, 50), 3) if ms else None,
+            'p95_ms': round(percentile(ms, 95), 3) if ms else None,
+            'p99_ms': round(percentile(ms, 99), 3) if ms else None,
+            'max_ms': round(ms[-1], 3) if ms else None,
+            'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_test_app(database, cache_type, write_behind=False):
+    """用指定的数据库导入 app.py"""
+    os.environ['DATABASE_URL'] = database
+    os.environ['CACHE_TYPE'] = cache_type
+    os.environ['REVIEW_WRITE_BEHIND'] = '1' if write_behind else ''
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app
+    return app
+
+
+def compare(previous, current):
+    """打印与之前结果相比 p50/p95/p99 的变化"""
+    print(f"\n与 {previous['meta'].get('git_commit') or '之前的结果'} 对比：")
+    print(f"{'scenario':<15} {'p50':>18} {'p95':>18} {'p99':>18}")
+    for scenario, result in current['scenarios'].items():
+        old = previous['scenarios'].get(scenario)
+        if not old:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if old.get(key) and result.get(key):
+                change = (result[key] - old[key]) / old[key] * 100
+                cells.append(f"{old[key]:.2f}->{result[key]:.2f} {change:+.0f}%")
+            else:
+                cells.append('-')
+        print(f"{scenario:<15} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--database', help='进程内模式使用的 SQLAlchemy 数据库 URI')
+    target.add_argument('--url', help='HTTP 模式下被压测服务的地址')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='每个场景的请求数')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=20, help='每个线程不计入统计的预热请求数')
+    parser.add_argument('--login-users', type=int, default=100, help='登录时从 bench_user_0..N-1 中随机选择')
+    parser.add_argument('--cache', default='null', choices=('null', 'memory', 'filesystem'),
+                        help='进程内模式下的 CACHE_TYPE，默认关闭缓存以测量数据库路径')
+    parser.add_argument('--write-behind', action='store_true', help='进程内模式下开启 REVIEW_WRITE_BEHIND')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    parser.add_argument('--compare', help='与之前保存的结果 JSON 对比')
+    args = parser.parse_args()
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        app = load_test_app(args.database, args.cache, args.write_behind)
+        make_client = lambda: TestClient(app)
+    runner = Runner(make_client, args.requests, args.concurrency, args.warmup, args.login_users, args.seed)
+    runner.discover()
+
+    result = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'mode': 'http' if args.url else 'test_client',
+            'target': args.url or args.database,
+            'cache': None if args.url else args.cache,
+            'write_behind': None if args.url else args.write_behind,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'python': platform.python_version(),
+        },
+        'scenarios': {},
+    }
+    print(f"{'scenario':<15} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for scenario in args.scenarios:
+        # 登录等路由里有 print 调试输出，进程内压测时丢弃，避免终端输出影响计时
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if not args.url else sys.stdout):
+            stats = runner.run_scenario(scenario)
+        result['scenarios'][scenario] = stats
+        print(f"{scenario:<15} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9} "
+              f"{stats['throughput_rps']:>9} {stats['errors']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+    failed = sum(stats['errors'] for stats in result['scenarios'].values())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
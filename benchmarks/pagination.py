@@ -0,0 +1,81 @@
+"""
+首页排行分页基准：OFFSET 分页 vs 游标分页
+
+在 SQLite 中生成一批带评分聚合的度假村，分别测量第 1 页到第 500 页的查询耗时。
+游标分页的耗时应基本不随页码增长，OFFSET 分页则随页码线性变慢。
+
+用法：
+    python -m benchmarks.pagination --resorts 20000 --pages 1 10 100 250 500
+"""
+import argparse
+import random
+import statistics
+import time
+from setup_db import db, Resort
+from pagination import ranked_resorts, encode_cursor, keyset_page
+from benchmarks.seed import create_app
+
+
+def seed_resorts(count, seed=42):
+    """批量插入 count 个度假村，约 10% 没有评分"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        rated = rng.random() > 0.1
+        ratings = rng.randint(1, 50) if rated else 0
+        rating_sum = sum(rng.randint(1, 10) for _ in range(ratings))
+        rows.append({
+            'country': 'Country%d' % (i % 30),
+            'city': 'City%d' % (i % 500),
+            'resort_name': 'Resort %d' % i,
+            'resort_type': 'type%d' % (i % 8),
+            'review_count': ratings,
+            'rating_count': ratings,
+            'rating_sum': rating_sum,
+            'avg_score': round(rating_sum / ratings, 2) if ratings else None,
+            'expenditure_count': 0,
+            'expenditure_sum': 0,
+        })
+    db.session.execute(db.insert(Resort), rows)
+    db.session.commit()
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run(resorts, pages, limit, repeat):
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed_resorts(resorts)
+        print(f"{'page':>6} {'offset (ms)':>12} {'cursor (ms)':>12}")
+        for page in pages:
+            offset = (page - 1) * limit
+            cursor = None
+            if offset:
+                # 游标取自上一页最后一条，与前端逐页点击得到的游标相同
+                cursor = encode_cursor(ranked_resorts().offset(offset - 1).limit(1).one())
+            offset_ms = _time(lambda: ranked_resorts().offset(offset).limit(limit).all(), repeat)
+            cursor_ms = _time(lambda: keyset_page(ranked_resorts(), cursor, limit), repeat)
+            print(f"{page:>6} {offset_ms:>12.3f} {cursor_ms:>12.3f}")
+            db.session.expunge_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resorts', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+    args = parser.parse_args()
+    run(args.resorts, args.pages, args.limit, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
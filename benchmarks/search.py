@@ -0,0 +1,57 @@
+"""
+搜索接口基准：在大量度假村上测量全文 + 分面查询的延迟
+
+用法：
+    python -m benchmarks.search --resorts 100000
+"""
+import argparse
+import random
+import statistics
+import time
+from setup_db import db
+from search import SearchIndex
+from benchmarks.seed import create_app, seed, COUNTRIES, RESORT_TYPES
+
+QUERIES = {
+    'no filter': lambda rng: ('', {}),
+    'prefix': lambda rng: ('bench res', {}),
+    'country': lambda rng: ('', {'country': rng.choice(COUNTRIES)}),
+    'country+type': lambda rng: ('', {'country': rng.choice(COUNTRIES), 'resort_type': rng.choice(RESORT_TYPES)}),
+    'text+city': lambda rng: ('resort', {'city': f'{rng.choice(COUNTRIES)} City {rng.randint(1, 200)}'}),
+    'exact name': lambda rng: (f'bench resort {rng.randint(0, 999)}', {}),
+}
+
+
+def run(resorts, repeat):
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(users=100, resorts=resorts, reviews=resorts, seed=42)
+        index = SearchIndex(app)
+        start = time.perf_counter()
+        index.search('', {})
+        print(f"建立倒排索引（{resorts} 个度假村）耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+        rng = random.Random(1)
+        print(f"{'query':<14} {'p50 ms':>8} {'p95 ms':>8} {'hits':>8}")
+        for name, make in QUERIES.items():
+            samples = []
+            for _ in range(repeat):
+                q, filters = make(rng)
+                begin = time.perf_counter()
+                items, total, facets = index.search(q, filters, 0, 20)
+                samples.append((time.perf_counter() - begin) * 1000)
+                db.session.expunge_all()
+            samples.sort()
+            print(f"{name:<14} {statistics.median(samples):>8.2f} {samples[int(len(samples) * 0.95) - 1]:>8.2f} {total:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resorts', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.resorts, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
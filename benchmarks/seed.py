@@ -0,0 +1,123 @@
+"""
+生成基准测试用的模拟数据
+
+按给定数量批量插入用户、度假村和评论（UserResort），然后重建评分聚合。
+同一个 --seed 生成的数据完全相同，不同提交之间的测试结果可以直接比较。
+
+用法：
+    python -m benchmarks.seed --database sqlite:///bench.db --users 1000 --resorts 5000 --reviews 100000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from flask import Flask
+from setup_db import db, User, Resort, UserResort
+from ratings import rebuild_aggregates
+
+BENCH_PASSWORD = 'Bench@123'
+COUNTRIES = ['China', 'United States', 'Japan', 'Thailand', 'France', 'Italy', 'Mexico', 'Indonesia', 'Spain', 'Greece']
+RESORT_TYPES = ['beach', 'ski', 'spa', 'island', 'mountain', 'golf', 'desert', 'lake']
+BATCH_SIZE = 5000
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance')
+
+
+def create_app(database_uri='sqlite://'):
+    """
+    只包含数据库的最小 Flask 应用，用来建表和写入数据
+
+    instance 目录与 app.py 相同，sqlite:///bench.db 这样的相对路径在两边指向同一个文件
+    """
+    app = Flask(__name__, instance_path=INSTANCE_PATH)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    db.init_app(app)
+    return app
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def seed(users, resorts, reviews, seed=42):
+    """
+    在当前应用上下文的数据库中写入模拟数据
+
+    用户名为 bench_user_<n>，密码统一为 BENCH_PASSWORD，方便压测登录接口。
+    评论在度假村之间按幂律分布，少数热门度假村拥有大部分评论。
+    """
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)
+    _insert(User, [{
+        'username': f'bench_user_{i}',
+        'nickname': f'Bench {i}',
+        'password': BENCH_PASSWORD,
+        'is_admin': False,
+        'created_at': now - timedelta(days=rng.randint(0, 365)),
+    } for i in range(users)])
+    user_ids = [row[0] for row in db.session.query(User.id).filter(User.username.like('bench_user_%'))]
+
+    resort_rows = []
+    for i in range(resorts):
+        country = rng.choice(COUNTRIES)
+        resort_rows.append({
+            'country': country,
+            'state': f'{country} State {rng.randint(1, 20)}',
+            'city': f'{country} City {rng.randint(1, 200)}',
+            'resort_name': f'Bench Resort {i}',
+            'resort_type': rng.choice(RESORT_TYPES),
+            'creator_id': rng.choice(user_ids) if user_ids else None,
+            'review_count': 0,
+            'rating_count': 0,
+            'rating_sum': 0,
+            'expenditure_count': 0,
+            'expenditure_sum': 0,
+        })
+    _insert(Resort, resort_rows)
+    resort_ids = [row[0] for row in db.session.query(Resort.id).filter(Resort.resort_name.like('Bench Resort %'))]
+
+    if user_ids and resort_ids:
+        review_rows = []
+        for _ in range(reviews):
+            # paretovariate 产生长尾：越靠前的度假村评论越多
+            index = min(int(rng.paretovariate(1.2)) - 1, len(resort_ids) - 1)
+            review_rows.append({
+                'user_id': rng.choice(user_ids),
+                'resort_id': resort_ids[(index * 7919) % len(resort_ids)],
+                'created_at': now - timedelta(minutes=rng.randint(0, 525600)),
+                'recommendation': rng.randint(1, 10) if rng.random() < 0.9 else None,
+                'expenditure': round(rng.uniform(100, 20000), 2) if rng.random() < 0.7 else None,
+                'comment': f'Bench review {rng.randint(0, 10 ** 6)}',
+            })
+            if len(review_rows) >= BATCH_SIZE:
+                _insert(UserResort, review_rows)
+                review_rows = []
+        _insert(UserResort, review_rows)
+    rebuild_aggregates()
+    rebuild_aggregates(model=User)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:///bench.db', help='SQLAlchemy 数据库 URI')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--resorts', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='写入前删除并重建所有表')
+    args = parser.parse_args()
+    app = create_app(args.database)
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        seed(args.users, args.resorts, args.reviews, args.seed)
+        print(f"写入 {args.users} 个用户、{args.resorts} 个度假村、{args.reviews} 条评论，"
+              f"耗时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
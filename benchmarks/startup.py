@@ -0,0 +1,76 @@
+"""
+测量 worker 冷启动时间
+
+每轮启动一个新的 Python 进程，依次计时：导入 app（相当于 gunicorn worker 加载 app:app）、
+第一个请求（打开数据库连接、首次渲染模板）。取多轮的中位数和最大值，
+冷启动总时间（进程启动 + 导入 + 第一个请求）超过 --target-ms 时以非零状态退出。
+
+用法：
+    python -m benchmarks.seed --database sqlite:///bench.db --reset
+    python -m benchmarks.startup --database sqlite:///bench.db --runs 10 --target-ms 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行：导入 app 并发出第一个请求，输出各阶段耗时
+CHILD = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app
+imported = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (done - imported) * 1000,
+    'status': response.status_code,
+}))
+"""
+
+
+def run_once(env, path):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, path], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['total_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', required=True, help='SQLAlchemy 数据库 URI（DATABASE_URL）')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/', help='第一个请求访问的路径')
+    parser.add_argument('--target-ms', type=float, default=1000, help='冷启动总时间的中位数目标')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database)
+    env.setdefault('SECRET_KEY', 'benchmark')
+    results = [run_once(env, args.path) for _ in range(args.runs)]
+    failed = [r['status'] for r in results if r['status'] != 200]
+    if failed:
+        print(f"第一个请求返回 {failed[0]}，请先运行 schema bootstrap 或 benchmarks.seed")
+        sys.exit(1)
+
+    print(f"{'phase':<16} {'median ms':>10} {'max ms':>10}")
+    for key in ('import_ms', 'first_request_ms', 'total_ms'):
+        values = [r[key] for r in results]
+        print(f"{key[:-3]:<16} {statistics.median(values):>10.1f} {max(values):>10.1f}")
+    median_total = statistics.median(r['total_ms'] for r in results)
+    ok = median_total <= args.target_ms
+    print(f"\n冷启动中位数 {median_total:.0f}ms，目标 {args.target_ms:.0f}ms：{'达标' if ok else '超出'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+"""
+页面与 JSON 接口的读穿透缓存
+
+- MemoryCache：进程内 LRU + TTL，适合单进程或开发环境
+- FileSystemCache：缓存写在本机目录中，同一台机器上的多个 gunicorn worker 共享
+- NullCache：关闭缓存
+
+每个缓存条目带若干标签（如 'ranking'、'resort:3'），标签的版本号参与缓存键。
+写入路径提交成功后调用 invalidate(标签)，换一个版本号，旧条目自然失效，不需要遍历所有键。
+cron 等在 web 进程之外运行的任务调用 invalidate(标签, shared=True)，新版本号同时写入 cache_tag 表；
+每个 worker 最多每 CACHE_SHARED_TAG_INTERVAL 秒读一次这张表，发现变化后在本进程内失效，
+所以即使用进程内的 memory 后端，其他进程的失效也能在几秒内生效。
+
+配置了只读副本时（见 replicas.py），刚写入的用户在粘滞期内绕过缓存直接读主库；
+标签失效后 REPLICA_STICKY_SECONDS 秒内从副本读出的响应可能还是写入前的数据，不写入缓存。
+
+页面中因人而异的部分（导航栏登录状态、闪现消息、评论表单）不进入缓存：
+缓存时 base.html 只输出占位注释，每次返回响应前再渲染对应的小模板填回去。
+
+JSON 等非 HTML 条目对所有用户相同：生成时计算内容哈希作为强 ETag，带 If-None-Match 的请求直接返回 304；
+按 Accept-Encoding 压缩后的内容也存进缓存，命中时不再重复压缩。
+"""
+import functools
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from collections import OrderedDict
+from urllib.parse import urlencode
+from markupsafe import Markup
+from flask import current_app, g, request, make_response, render_template
+from sqlalchemy.exc import SQLAlchemyError
+import compression
+from replicas import reading_own_writes, replica_was_read
+from setup_db import db, CacheTag
+
+HOLE_PREFIX = '<!--cache-hole:'
+HOLE_SUFFIX = '-->'
+
+
+class MemoryCache:
+    """进程内 LRU 缓存，条目过期或超出容量时淘汰"""
+
+    def __init__(self, max_entries=1000, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _private_directory(directory):
+    """创建或检查只有当前用户能访问的目录，属于其他用户或是符号链接时抛出 PermissionError"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"缓存目录 {directory} 不是普通目录（可能是符号链接），拒绝使用")
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise PermissionError(f"缓存目录 {directory} 属于其他用户，拒绝使用")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+
+
+class FileSystemCache:
+    """
+    基于本地目录的共享缓存
+
+    每个键对应一个文件，写入时先写临时文件再 os.replace，多个 worker 并发读写也不会读到半个文件。
+    文件数超过 max_entries 时按修改时间删除最旧的一批。
+    条目用 pickle 读取，能往目录里放文件的人就能在 web 进程中执行代码，
+    所以目录必须属于当前用户且权限为 0700，否则拒绝使用。
+    """
+
+    def __init__(self, directory, max_entries=5000, default_ttl=60):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        _private_directory(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time() + ttl, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._prune()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _prune(self):
+        entries = os.listdir(self.directory)
+        if len(entries) <= self.max_entries:
+            return
+        paths = [os.path.join(self.directory, name) for name in entries]
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        # 一次多删 10%，避免每次写入都触发清理
+        for path in paths[:len(paths) - int(self.max_entries * 0.9)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class NullCache:
+    """不缓存任何内容"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class ResponseCache:
+    """把视图函数的响应按路由和参数缓存起来，并按标签精确失效"""
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.default_ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.not_modified = 0
+        self.shared_interval = 2.0
+        self._shared_versions = None
+        self._shared_checked = 0.0
+        self._listeners = []
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        根据配置选择缓存后端
+
+        CACHE_TYPE: 'memory'（默认）、'filesystem' 或 'null'
+        CACHE_DEFAULT_TTL: 默认过期秒数
+        CACHE_MAX_ENTRIES: 最多保存的条目数
+        CACHE_DIR: filesystem 后端的缓存目录
+        CACHE_SHARED_TAG_INTERVAL: 检查 cache_tag 表的最短间隔秒数，默认 2
+        """
+        cache_type = app.config.get('CACHE_TYPE', 'memory')
+        self.default_ttl = int(app.config.get('CACHE_DEFAULT_TTL', 60))
+        self.shared_interval = float(app.config.get('CACHE_SHARED_TAG_INTERVAL', 2))
+        max_entries = int(app.config.get('CACHE_MAX_ENTRIES', 1000))
+        if cache_type == 'memory':
+            self.backend = MemoryCache(max_entries, self.default_ttl)
+        elif cache_type == 'filesystem':
+            directory = app.config.get('CACHE_DIR') or os.path.join(
+                tempfile.gettempdir(), f"travelhub-cache-{os.getuid() if hasattr(os, 'getuid') else 0}")
+            self.backend = FileSystemCache(directory, max_entries, self.default_ttl)
+        elif cache_type == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError(f"Unknown CACHE_TYPE: {cache_type}")
+        app.extensions['response_cache'] = self
+        app.add_template_global(personal_fragment)
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _tag_version(self, tag):
+        version = self.backend.get('tag:' + tag)
+        if version is None:
+            version = uuid.uuid4().hex
+            self.backend.set('tag:' + tag, version, ttl=86400 * 30)
+        return version
+
+    def invalidate(self, *tags, shared=False):
+        """
+        写入成功后调用，使带有这些标签的缓存条目全部失效
+
+        Args:
+            shared: 在 web 进程之外（CLI、cron）调用时为 True，同时通知所有 worker
+        """
+        for tag in tags:
+            version = uuid.uuid4().hex
+            self.backend.set('tag:' + tag, version, ttl=86400 * 30)
+            # 记录失效时间（墙上时间，filesystem 后端的多个 worker 之间可比较）
+            self.backend.set('tag-at:' + tag, time.time(), ttl=86400 * 30)
+            self._count('invalidations')
+            for listener in self._listeners:
+                listener(tag)
+            if shared:
+                values = {'version': version, 'updated_at': datetime.now()}
+                if not db.session.execute(db.update(CacheTag).where(CacheTag.tag == tag).values(values)).rowcount:
+                    db.session.execute(db.insert(CacheTag).values(dict(values, tag=tag)))
+        if shared:
+            db.session.commit()
+
+    def on_invalidate(self, listener):
+        """注册失效回调，参数为标签；进程内有自己缓存的组件（如推荐）用它同步失效"""
+        self._listeners.append(listener)
+        return listener
+
+    def sync_shared_tags(self):
+        """读取其他进程写入 cache_tag 的失效，最多每 shared_interval 秒查询一次"""
+        now = time.monotonic()
+        if now - self._shared_checked < self.shared_interval:
+            return
+        self._shared_checked = now
+        try:
+            # 直接用主库连接，不占用请求的会话，也不会读到落后的副本
+            with db.engine.connect() as connection:
+                rows = connection.execute(db.select(CacheTag.tag, CacheTag.version)).all()
+        except SQLAlchemyError:
+            # 还没有执行迁移时没有这张表
+            return
+        versions = dict(rows)
+        # 第一次读取只记录下来：本进程的缓存本来就是在这之后生成的
+        if self._shared_versions is not None:
+            for tag, version in versions.items():
+                if self._shared_versions.get(tag) != version:
+                    self.invalidate(tag)
+        self._shared_versions = versions
+
+    def _replica_lagging(self, tags):
+        """本次响应读了副本，且某个标签刚失效不久，副本可能还没有复制到那次写入"""
+        routing = current_app.extensions.get('replica_routing')
+        if routing is None or not replica_was_read():
+            return False
+        since = time.time() - routing.sticky_seconds
+        return any((self.backend.get('tag-at:' + tag) or 0) > since for tag in tags)
+
+    def make_key(self, tags):
+        # 重新编码查询参数，值里的 & 和 = 不会与参数分隔符混淆（?q=a%26b=c 与 ?q=a&b=c 是不同的键）
+        args = urlencode(sorted(request.args.items(multi=True)))
+        versions = ','.join(f"{tag}@{self._tag_version(tag)}" for tag in tags)
+        return f"view:{request.endpoint}:{sorted(request.view_args.items())}:{args}:{versions}"
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'not_modified': self.not_modified,
+            'hit_rate': round(self.hits / total, 4) if total else None,
+        }
+
+    def cached(self, tags, ttl=None):
+        """
+        缓存 GET 请求的视图响应
+
+        Args:
+            tags: 接收视图参数、返回标签列表的函数，例如 lambda resort_id: ['resort:%d' % resort_id]
+            ttl: 过期秒数，默认使用 CACHE_DEFAULT_TTL
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or reading_own_writes():
+                    # 粘滞期内读主库，缓存中的条目可能是别人从落后的副本读出来的
+                    return view(*args, **kwargs)
+                self.sync_shared_tags()
+                entry_tags = tags(**kwargs)
+                key = self.make_key(entry_tags)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count('hits')
+                else:
+                    self._count('misses')
+                    # 渲染时让模板为个性化部分留出占位
+                    g.cache_holes = True
+                    try:
+                        response = make_response(view(*args, **kwargs))
+                    finally:
+                        g.cache_holes = False
+                    if response.status_code != 200 or response.direct_passthrough or g.pop('cache_skip', False) \
+                            or self._replica_lagging(entry_tags):
+                        return response
+                    body, content_type = response.get_data(), response.headers['Content-Type']
+                    entry = (body, content_type) if content_type.startswith('text/html') \
+                        else (body, content_type, content_etag(body))
+                    self.backend.set(key, entry, self.default_ttl if ttl is None else ttl)
+                body, content_type = entry[:2]
+                if content_type.startswith('text/html'):
+                    body = fill_holes(body.decode('utf-8'))
+                    return make_response(body, 200, {'Content-Type': content_type})
+                return self._shared_response(key, entry, self.default_ttl if ttl is None else ttl)
+            return wrapper
+        return decorator
+
+    def _shared_response(self, key, entry, ttl):
+        """对所有用户相同的条目：处理 If-None-Match，返回（压缩后的）缓存内容"""
+        body, content_type = entry[:2]
+        etag = entry[2] if len(entry) > 2 else content_etag(body)
+        headers = {'Content-Type': content_type, 'Cache-Control': 'no-cache'}
+        encoder = current_app.extensions.get('response_compression')
+        encoding = None
+        if encoder is not None and encoder.enabled and compression.compressible(content_type, len(body), encoder.min_size):
+            headers['Vary'] = 'Accept-Encoding'
+            encoding = compression.negotiate(request.accept_encodings)
+        if encoding:
+            etag = f'{etag}-{encoding}'
+        if request.if_none_match.contains_weak(etag):
+            self._count('not_modified')
+            response = make_response(b'', 304, {k: v for k, v in headers.items() if k != 'Content-Type'})
+            response.set_etag(etag)
+            return response
+        if encoding:
+            encoded = self.backend.get(f'{key}:{encoding}')
+            if encoded is None:
+                encoded = compression.compress(body, encoding)
+                self.backend.set(f'{key}:{encoding}', encoded, ttl)
+            encoder.record(len(body), len(encoded))
+            body = encoded
+            headers['Content-Encoding'] = encoding
+        response = make_response(body, 200, headers)
+        response.set_etag(etag)
+        return response
+
+
+def skip_cache():
+    """视图调用：本次响应可能基于过时的数据，照常返回但不写入缓存"""
+    g.cache_skip = True
+
+
+def content_etag(body):
+    """按内容计算的强 ETag，所有 worker 对同样的内容给出同样的值"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def personal_fragment(template):
+    """
+    模板全局函数：渲染因人而异的页面片段
+
+    正在生成缓存内容时只输出占位注释，由 fill_holes 在每次响应时填入当前用户的内容。
+    """
+    if g.get('cache_holes'):
+        return Markup(HOLE_PREFIX + template + HOLE_SUFFIX)
+    return Markup(render_template(template))
+
+
+def fill_holes(html):
+    """把缓存页面中的占位注释替换成为当前用户渲染的模板片段"""
+    start = html.find(HOLE_PREFIX)
+    while start != -1:
+        end = html.index(HOLE_SUFFIX, start)
+        fragment = render_template(html[start + len(HOLE_PREFIX):end])
+        html = html[:start] + fragment + html[end + len(HOLE_SUFFIX):]
+        start = html.find(HOLE_PREFIX, start + len(fragment))
+    return html
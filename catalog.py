@@ -0,0 +1,400 @@
+"""
+度假村与评论的批量导入导出
+
+`flask --app app catalog import resorts resorts.csv` 逐条读取 CSV 或 JSONL（按扩展名判断，或用 --format 指定），
+每 --batch-size 条用一条多行 INSERT 写入并提交，内存占用与文件大小无关。列名：
+
+- resorts：resort_name, country, state, city, county, resort_type, creator（用户名）, picture, id（可选，保留原 id）
+- reviews：username, resort_id, recommendation, expenditure, comment, created_at（ISO 8601，可选）
+
+创建者和评论者按用户名解析，结果放在 LRU 缓存里，每批未命中的用户名只查询一次。
+找不到用户或度假村、字段不合法的行跳过并输出行号，不影响其余行。
+评论与评分聚合在同一个事务里写入，与网页提交评论的结果一致。
+
+picture 默认按相对 static 的路径原样保存（与 export 的输出一致）。指定 --images-dir 时，
+从该目录读取图片，按内容哈希复制到 static/resort_pics；再加 --process-images 在后台线程生成各尺寸变体。
+
+每批提交时在同一个事务里把已处理的条数写入 import_checkpoint。中途失败后重新执行同样的命令，
+已提交的行会被跳过，不会重复导入；--restart 忽略检查点从头开始。
+
+`catalog export resorts|reviews` 用同样的列流式导出，导出的文件可以直接导入另一个数据库。
+"""
+import contextlib
+import csv
+import json
+import os
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from cache import MemoryCache
+from setup_db import db, eastern, User, Resort, UserResort, ImportCheckpoint
+from ratings import record_reviews_many, record_user_activity
+
+catalog_cli = AppGroup('catalog', help='度假村与评论的批量导入导出')
+
+FIELDS = {
+    'resorts': ('id', 'resort_name', 'country', 'state', 'city', 'county', 'resort_type', 'creator', 'picture'),
+    'reviews': ('username', 'resort_id', 'recommendation', 'expenditure', 'comment', 'created_at'),
+}
+RESORT_TEXT_FIELDS = ('resort_name', 'country', 'state', 'city', 'county', 'resort_type')
+RESORT_REQUIRED = ('resort_name', 'country', 'resort_type')
+# IN (...) 查询每次最多带多少个值
+LOOKUP_CHUNK = 500
+PROGRESS_INTERVAL = 5
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def _open(path, mode):
+    """PATH 为 - 时使用标准输入/输出；newline='' 交给 csv 模块处理换行"""
+    if path == '-':
+        return contextlib.nullcontext(click.get_text_stream('stdin' if mode == 'r' else 'stdout'))
+    return open(path, mode, encoding='utf-8-sig' if mode == 'r' else 'utf-8', newline='')
+
+
+def read_records(stream, fmt):
+    """
+    逐条读取记录
+
+    Yields:
+        (行号, dict)；JSONL 中无法解析的行给出 None
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(record, model, key, required=False):
+    value = record.get(key)
+    if _blank(value):
+        if required:
+            raise ValueError(f"缺少 {key}")
+        return None
+    value = str(value).strip()
+    length = getattr(model.__table__.c[key].type, 'length', None)
+    if length and len(value) > length:
+        raise ValueError(f"{key} 超过 {length} 个字符")
+    return value
+
+
+def _number(record, key, cast, minimum=None, maximum=None, required=False):
+    value = record.get(key)
+    if _blank(value):
+        if required:
+            raise ValueError(f"缺少 {key}")
+        return None
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} 不是合法的数字: {value!r}")
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ValueError(f"{key} 超出范围: {value!r}")
+    return number
+
+
+def _datetime(record, key):
+    value = record.get(key)
+    if _blank(value):
+        return None
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{key} 不是 ISO 8601 时间: {value!r}")
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        yield values[start:start + LOOKUP_CHUNK]
+
+
+class UserLookup:
+    """用户名 -> 用户 id，命中的结果放在有上限的 LRU 缓存里"""
+
+    def __init__(self, max_entries=10000):
+        self.cache = MemoryCache(max_entries=max_entries, default_ttl=86400)
+
+    def resolve(self, usernames):
+        found = {}
+        missing = []
+        for username in set(usernames):
+            user_id = self.cache.get(username)
+            if user_id is None:
+                missing.append(username)
+            else:
+                found[username] = user_id
+        for chunk in _chunks(missing):
+            for user_id, username in db.session.execute(
+                db.select(User.id, User.username).where(User.username.in_(chunk))
+            ):
+                self.cache.set(username, user_id)
+                found[username] = user_id
+        return found
+
+
+class Importer:
+    """按批写入一种记录，返回 (写入条数, [(行号, 原因)])"""
+
+    def __init__(self, users, images_dir=None, pipeline=None):
+        self.users = users
+        self.images_dir = images_dir
+        self.pipeline = pipeline
+        # 本批写入的新图片 (路径, 哈希)，提交后才能交给后台生成变体
+        self.new_images = []
+
+
+class ResortImporter(Importer):
+
+    def write(self, batch):
+        rejected = []
+        parsed = []
+        for number, record in batch:
+            try:
+                if record is None:
+                    raise ValueError("不是合法的 JSON 对象")
+                row = {key: _text(record, Resort, key, key in RESORT_REQUIRED) for key in RESORT_TEXT_FIELDS}
+                resort_id = _number(record, 'id', int, minimum=1)
+                if resort_id is not None:
+                    row['id'] = resort_id
+                creator = record.get('creator')
+                parsed.append((number, row, None if _blank(creator) else str(creator).strip(), record.get('picture')))
+            except ValueError as e:
+                rejected.append((number, str(e)))
+        creators = self.users.resolve(creator for _, _, creator, _ in parsed if creator)
+        # 显式给出的 id 已被占用时只拒绝这一行，否则整批插入会因主键冲突回滚，从检查点继续也过不去
+        taken = set()
+        for chunk in _chunks({row['id'] for _, row, _, _ in parsed if 'id' in row}):
+            taken.update(db.session.execute(db.select(Resort.id).where(Resort.id.in_(chunk))).scalars())
+        rows = []
+        for number, row, creator, picture in parsed:
+            if creator and creator not in creators:
+                rejected.append((number, f"找不到用户 {creator}"))
+                continue
+            if 'id' in row:
+                if row['id'] in taken:
+                    rejected.append((number, f"度假村 id {row['id']} 已存在"))
+                    continue
+                taken.add(row['id'])
+            row['creator_id'] = creators.get(creator)
+            if not _blank(picture):
+                try:
+                    self._attach_picture(row, str(picture).strip())
+                except (OSError, ValueError) as e:
+                    # 只拒绝这一行：文件不存在、没有扩展名、不是允许的图片类型或内容不是图片
+                    rejected.append((number, f"无法导入图片 {picture}: {e}"))
+                    continue
+            rows.append(row)
+        if rows:
+            db.session.execute(db.insert(Resort), rows)
+            by_creator = {}
+            for row in rows:
+                if row['creator_id'] is not None:
+                    by_creator[row['creator_id']] = by_creator.get(row['creator_id'], 0) + 1
+            record_user_activity(resorts=by_creator)
+        return len(rows), rejected
+
+    def _attach_picture(self, row, picture):
+        if self.images_dir is None:
+            row['picture_local_address'] = picture
+            return
+        path, digest, variants = self.pipeline.store_file(os.path.join(self.images_dir, picture))
+        row.update(picture_local_address=path, picture_hash=digest, picture_variants=variants)
+        if variants is None:
+            self.new_images.append((path, digest))
+
+
+class ReviewImporter(Importer):
+
+    def write(self, batch):
+        rejected = []
+        parsed = []
+        for number, record in batch:
+            try:
+                if record is None:
+                    raise ValueError("不是合法的 JSON 对象")
+                username = _text(record, User, 'username', required=True)
+                row = {
+                    'resort_id': _number(record, 'resort_id', int, required=True),
+                    'recommendation': _number(record, 'recommendation', int, 1, 10),
+                    'expenditure': _number(record, 'expenditure', float, 0),
+                    'comment': _text(record, UserResort, 'comment'),
+                    'created_at': _datetime(record, 'created_at') or datetime.now(eastern),
+                }
+                parsed.append((number, username, row))
+            except ValueError as e:
+                rejected.append((number, str(e)))
+        users = self.users.resolve(username for _, username, _ in parsed)
+        resort_ids = set()
+        for chunk in _chunks({row['resort_id'] for _, _, row in parsed}):
+            resort_ids.update(db.session.execute(db.select(Resort.id).where(Resort.id.in_(chunk))).scalars())
+        rows = []
+        for number, username, row in parsed:
+            if username not in users:
+                rejected.append((number, f"找不到用户 {username}"))
+            elif row['resort_id'] not in resort_ids:
+                rejected.append((number, f"找不到度假村 {row['resort_id']}"))
+            else:
+                row['user_id'] = users[username]
+                rows.append(row)
+        if rows:
+            db.session.execute(db.insert(UserResort), rows)
+            by_resort, by_user = {}, {}
+            for row in rows:
+                review = (row['recommendation'], row['expenditure'])
+                by_resort.setdefault(row['resort_id'], []).append(review)
+                by_user.setdefault(row['user_id'], []).append(review)
+            record_reviews_many(by_resort)
+            record_user_activity(by_user)
+        return len(rows), rejected
+
+
+IMPORTERS = {'resorts': ResortImporter, 'reviews': ReviewImporter}
+
+
+def _checkpoint_source(kind, path):
+    return f"{kind}:{os.path.abspath(path)}"[:ImportCheckpoint.__table__.c.source.type.length]
+
+
+@catalog_cli.command('import')
+@click.argument('kind', type=click.Choice(list(IMPORTERS)))
+@click.argument('path', type=click.Path(allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='默认按扩展名判断，其余按 CSV 处理')
+@click.option('--batch-size', type=click.IntRange(min=1), default=1000, show_default=True)
+@click.option('--images-dir', type=click.Path(exists=True, file_okay=False), help='picture 列相对的图片目录')
+@click.option('--process-images', is_flag=True, help='导入后在后台生成图片的各尺寸变体')
+@click.option('--restart', is_flag=True, help='忽略检查点，从第一行开始导入')
+def import_command(kind, path, fmt, batch_size, images_dir, process_images, restart):
+    """流式导入度假村或评论（PATH 为 - 时读取标准输入，此时不记录检查点）"""
+    fmt = detect_format(path, fmt)
+    pipeline = current_app.extensions['image_pipeline']
+    importer = IMPORTERS[kind](UserLookup(), images_dir, pipeline)
+    source = None if path == '-' else _checkpoint_source(kind, path)
+    skip = 0
+    if source is not None:
+        checkpoint = db.session.get(ImportCheckpoint, source)
+        if checkpoint is not None and not restart:
+            skip = checkpoint.position
+            click.echo(f"从检查点继续：跳过已导入的前 {skip} 条")
+    db.session.commit()
+
+    # 后台生成变体的任务数有上限，导入速度不会被图片处理拖成无限长的队列
+    pending = set()
+    max_pending = max(2, 4 * int(current_app.config.get('IMAGE_WORKERS', 2)))
+    scheduled = MemoryCache(max_entries=10000, default_ttl=86400)
+
+    start = last_report = time.perf_counter()
+    processed = imported = rejected = 0
+    batch = []
+
+    def flush(position):
+        nonlocal imported, rejected
+        written, errors = importer.write(batch)
+        if source is not None:
+            db.session.merge(ImportCheckpoint(source=source, position=position, updated_at=datetime.now()))
+        db.session.commit()
+        imported += written
+        rejected += len(errors)
+        for number, reason in errors:
+            click.echo(f"第 {number} 行已跳过：{reason}", err=True)
+        if process_images:
+            for picture_path, digest in importer.new_images:
+                if scheduled.get(digest):
+                    continue
+                scheduled.set(digest, True)
+                while len(pending) >= max_pending:
+                    _, still_running = wait(pending, return_when=FIRST_COMPLETED)
+                    pending.intersection_update(still_running)
+                result = pipeline.schedule(picture_path, digest)
+                if isinstance(result, Future):
+                    pending.add(result)
+        importer.new_images.clear()
+        batch.clear()
+
+    with _open(path, 'r') as stream:
+        for position, record in enumerate(read_records(stream, fmt), 1):
+            if position <= skip:
+                continue
+            batch.append(record)
+            processed += 1
+            if len(batch) >= batch_size:
+                flush(position)
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    click.echo(f"已处理 {processed} 条，{processed / (now - start):.0f} 条/秒")
+        if batch:
+            flush(skip + processed)
+    wait(pending)
+    elapsed = time.perf_counter() - start
+
+    if source is not None:
+        # 全部完成后删除检查点，下次导入同一个文件时从头开始
+        db.session.execute(db.delete(ImportCheckpoint).where(ImportCheckpoint.source == source))
+        db.session.commit()
+    response_cache = current_app.extensions.get('response_cache')
+    if response_cache is not None and imported:
+        # CLI 与 web worker 不在同一个进程，通过 cache_tag 表通知它们
+        response_cache.invalidate('ranking', shared=True)
+    click.echo(f"导入 {imported} 条，跳过 {rejected} 条，耗时 {elapsed:.2f}s，"
+               f"{processed / elapsed if elapsed else 0:.0f} 条/秒")
+
+
+def export_query(kind):
+    if kind == 'resorts':
+        return db.select(
+            Resort.id, Resort.resort_name, Resort.country, Resort.state, Resort.city, Resort.county,
+            Resort.resort_type, User.username.label('creator'), Resort.picture_local_address.label('picture')
+        ).outerjoin(User, User.id == Resort.creator_id).order_by(Resort.id)
+    return db.select(
+        User.username, UserResort.resort_id, UserResort.recommendation, UserResort.expenditure,
+        UserResort.comment, UserResort.created_at
+    ).join(User, User.id == UserResort.user_id).order_by(UserResort.id)
+
+
+@catalog_cli.command('export')
+@click.argument('kind', type=click.Choice(list(FIELDS)))
+@click.argument('path', type=click.Path(allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='默认按扩展名判断，其余按 CSV 处理')
+def export_command(kind, path, fmt):
+    """流式导出度假村或评论（PATH 为 - 时写到标准输出）"""
+    fmt = detect_format(path, fmt)
+    start = time.perf_counter()
+    exported = 0
+    result = db.session.execute(export_query(kind).execution_options(yield_per=1000)).mappings()
+    with _open(path, 'w') as stream:
+        writer = csv.DictWriter(stream, FIELDS[kind]) if fmt == 'csv' else None
+        if writer is not None:
+            writer.writeheader()
+        for row in result:
+            row = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+            exported += 1
+    elapsed = time.perf_counter() - start
+    click.echo(f"导出 {exported} 条，耗时 {elapsed:.2f}s，{exported / elapsed if elapsed else 0:.0f} 条/秒",
+               err=path == '-')
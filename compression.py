@@ -0,0 +1,118 @@
+"""
+响应压缩
+
+按请求的 Accept-Encoding 选择 br（安装了可选依赖 brotli 时）或 gzip，压缩 HTML、JSON、CSS、JS 等文本响应。
+缓存的 JSON 接口在 cache.py 中把压缩后的内容和缓存条目一起保存，命中缓存时不再重复压缩；
+其余响应由这里的 after_request 在返回前压缩。
+"""
+import gzip
+import threading
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：pip install brotli
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+GZIP_LEVEL = 6
+# 11 的压缩率略高，但比 gzip 慢一个数量级；5 的速度与 gzip 相当，体积更小
+BROTLI_QUALITY = 5
+# 离线构建静态资源时用最高压缩率，只压缩一次
+GZIP_BEST_LEVEL = 9
+BROTLI_BEST_QUALITY = 11
+DEFAULT_MIN_SIZE = 512
+
+
+def available_encodings():
+    """服务端支持的编码，按优先顺序排列"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings, encodings=None):
+    """
+    从 werkzeug 的 Accept 对象中选择编码：q 值最高者优先，相同时优先 br
+
+    Args:
+        encodings: 可选的编码，默认为 available_encodings()（预压缩的静态文件只能选已经生成的）
+
+    Returns:
+        'br'、'gzip'，客户端都不接受时返回 None
+    """
+    best, best_quality = None, 0
+    for encoding in available_encodings() if encodings is None else encodings:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(content_type, size, min_size=DEFAULT_MIN_SIZE):
+    """太小的响应压缩后省不了几个字节，反而多花 CPU"""
+    return size >= min_size and (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding, best=False):
+    """best=True 时使用最高压缩率（慢得多，只用于离线构建）"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_BEST_QUALITY if best else BROTLI_QUALITY)
+    # mtime=0：同样的内容得到同样的字节，缓存和 ETag 都更稳定
+    return gzip.compress(data, GZIP_BEST_LEVEL if best else GZIP_LEVEL, mtime=0)
+
+
+def add_vary(response):
+    response.vary.add('Accept-Encoding')
+
+
+class ResponseCompression:
+    """在返回前压缩尚未编码的文本响应，并统计压缩前后的字节数"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.min_size = DEFAULT_MIN_SIZE
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        COMPRESS_RESPONSES: 是否压缩响应，默认开启（前面的反向代理已经压缩时可以关闭）
+        COMPRESS_MIN_SIZE: 小于这个字节数的响应不压缩，默认 512
+        """
+        self.enabled = bool(app.config.get('COMPRESS_RESPONSES', True))
+        self.min_size = int(app.config.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE))
+        app.extensions['response_compression'] = self
+        app.after_request(self._after_request)
+
+    def record(self, original, compressed):
+        with self._stats_lock:
+            self.bytes_in += original
+            self.bytes_out += compressed
+
+    def _after_request(self, response):
+        if (not self.enabled or response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or not compressible(response.mimetype, response.calculate_content_length() or 0, self.min_size)):
+            return response
+        add_vary(response)
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        compressed = compress(data, encoding)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            # 强 ETag 对应具体的字节，压缩后的表示需要不同的 ETag
+            response.set_etag(f'{etag}-{encoding}', weak)
+        self.record(len(data), len(compressed))
+        return response
+
+    def stats(self):
+        return [
+            ('travelhub_compression_bytes_in_total', 'Response bytes before compression.', 'counter', self.bytes_in),
+            ('travelhub_compression_bytes_out_total', 'Response bytes after compression.', 'counter', self.bytes_out),
+        ]
@@ -0,0 +1,294 @@
+"""
+度假村图片上传处理
+
+上传时把原图按内容哈希保存下来（相同图片只存一份），保存前去掉 EXIF（含 GPS 位置）等元数据；
+缩放、重新压缩、生成 WebP 都交给后台线程池完成，
+完成后把各尺寸图片的路径写入 Resort.picture_variants。
+页面通过 srcset 让浏览器按卡片/详情页的实际显示尺寸选择合适的图片。
+"""
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app, url_for
+from flask.cli import AppGroup
+from PIL import Image, ImageOps
+from setup_db import db, Resort
+
+# 变体名称 -> 最大宽度（像素）。首页卡片约 400px 宽，card_2x 用于高分屏
+VARIANT_WIDTHS = {
+    'card': 480,
+    'card_2x': 960,
+    'detail': 1200,
+}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# 扩展名对应的 Pillow 格式，内容与扩展名不符的文件不保存
+IMAGE_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'gif': 'GIF'}
+ORIENTATION_TAG = 0x0112
+
+images_cli = AppGroup('images', help='度假村图片处理')
+
+
+def image_extension(filename):
+    """小写的扩展名；没有扩展名或不是允许的图片类型时抛出 ValueError"""
+    name = os.path.basename(filename or '')
+    ext = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValueError(f"不支持的图片类型: {name or filename}")
+    return ext
+
+
+def verify_image(data, ext):
+    """用 Pillow 检查内容确实是扩展名对应格式的图片，避免把任意文件放进公开的静态目录"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            image_format = img.format
+            img.verify()
+    except Exception as e:
+        raise ValueError("无法识别的图片内容") from e
+    if image_format != IMAGE_FORMATS[ext]:
+        raise ValueError(f"图片内容是 {image_format}，与扩展名 .{ext} 不符")
+
+
+def strip_metadata(data):
+    """
+    去掉原图的 EXIF、XMP 等元数据，原图在变体生成之前会直接在页面上显示，不能带着拍摄位置
+
+    有 EXIF 方向时先旋转再重新编码；没有时 JPEG 沿用原来的量化表，画质不变。
+    保留 ICC 颜色配置。动图原样保存（GIF 没有 EXIF 段）。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        if getattr(img, 'is_animated', False):
+            return data
+        image_format = img.format
+        options = {}
+        if img.info.get('icc_profile'):
+            options['icc_profile'] = img.info['icc_profile']
+        if image_format == 'JPEG' and img.getexif().get(ORIENTATION_TAG, 1) == 1:
+            options.update(quality='keep', subsampling='keep')
+        else:
+            img = ImageOps.exif_transpose(img)
+            if image_format == 'JPEG':
+                options['quality'] = 95
+        buffer = io.BytesIO()
+        img.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+class ImagePipeline:
+    """保存上传图片并在后台生成多尺寸变体"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        IMAGE_WORKERS: 后台处理线程数，默认 2
+        IMAGE_PIPELINE_SYNC: 为 True 时在请求内同步处理（测试和批量导入使用）
+        IMAGE_WEBP: 是否额外生成 WebP，默认生成
+        """
+        self.app = app
+        self.folder = app.config['UPLOAD_FOLDER']
+        self.sync = app.config.get('IMAGE_PIPELINE_SYNC', False)
+        self.webp = app.config.get('IMAGE_WEBP', True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(app.config.get('IMAGE_WORKERS', 2)),
+            thread_name_prefix='image-pipeline'
+        )
+        app.extensions['image_pipeline'] = self
+        app.add_template_global(image_sources)
+
+    def store_upload(self, file_storage):
+        """
+        按内容哈希保存上传的原图
+
+        Returns:
+            (相对 static 的原图路径, 内容哈希, 已有的变体或 None)
+            如果同一张图片之前已经处理过，直接复用它的变体
+        """
+        return self.store_bytes(file_storage.read(), image_extension(file_storage.filename))
+
+    def store_file(self, path):
+        """按内容哈希复制本地图片（批量导入使用），返回值与 store_upload 相同"""
+        ext = image_extension(path)
+        with open(path, 'rb') as f:
+            return self.store_bytes(f.read(), ext)
+
+    def store_bytes(self, data, ext):
+        """图片内容无法识别或与扩展名不符时抛出 ValueError"""
+        verify_image(data, ext)
+        digest = hashlib.sha256(data).hexdigest()
+        filename = f"{digest[:32]}.{ext}"
+        save_path = os.path.join(self.folder, filename)
+        if not os.path.exists(save_path):
+            # 哈希按上传的内容计算（相同图片仍然只存一份），落盘的是去掉元数据的版本
+            tmp_path = save_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(strip_metadata(data))
+            os.replace(tmp_path, save_path)
+        existing = Resort.query.filter(
+            Resort.picture_hash == digest,
+            Resort.picture_variants.isnot(None)
+        ).first()
+        variants = existing.picture_variants if existing else None
+        return os.path.join('resort_pics', filename), digest, variants
+
+    def schedule(self, picture_path, digest, on_done=None):
+        """
+        提交后台任务生成变体，完成后更新所有使用这张图片的度假村
+
+        Args:
+            on_done: 变体写入数据库后调用，用于让页面缓存失效
+        """
+        if self.sync:
+            return self._run(picture_path, digest, on_done)
+        return self.executor.submit(self._run, picture_path, digest, on_done)
+
+    def _run(self, picture_path, digest, on_done):
+        try:
+            variants = self.process(picture_path, digest)
+        except Exception as e:
+            print(f"图片处理失败 {picture_path}: {e}")
+            return None
+        if not variants:
+            return None
+        with self.app.app_context():
+            Resort.query.filter_by(picture_hash=digest).update(
+                {'picture_variants': variants}, synchronize_session=False
+            )
+            db.session.commit()
+        if on_done:
+            on_done()
+        return variants
+
+    def process(self, picture_path, digest):
+        """
+        生成各尺寸变体
+
+        Returns:
+            {变体名: {'width': 宽度, 'path': 路径, 'webp': WebP 路径}}；动图不处理，返回 None
+        """
+        source = os.path.join(self.folder, os.path.basename(picture_path))
+        with Image.open(source) as img:
+            if getattr(img, 'is_animated', False):
+                return None
+            # 按 EXIF 方向旋转后再丢弃元数据
+            img = ImageOps.exif_transpose(img)
+            has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+            variants = {}
+            for name, max_width in VARIANT_WIDTHS.items():
+                width = min(max_width, img.width)
+                if variants and width == img.width and any(v['width'] == width for v in variants.values()):
+                    # 原图比较小时，不同变体会得到相同尺寸，不重复生成
+                    continue
+                height = max(1, round(img.height * width / img.width))
+                resized = img.resize((width, height), Image.LANCZOS) if width != img.width else img
+                ext = 'png' if has_alpha else 'jpg'
+                filename = f"{digest[:32]}_{name}.{ext}"
+                variant = {'width': width, 'path': os.path.join('resort_pics', filename)}
+                self._save(resized, filename, 'PNG' if has_alpha else 'JPEG')
+                if self.webp:
+                    webp_name = f"{digest[:32]}_{name}.webp"
+                    self._save(resized, webp_name, 'WEBP')
+                    variant['webp'] = os.path.join('resort_pics', webp_name)
+                variants[name] = variant
+        return variants
+
+    def _save(self, img, filename, image_format):
+        # 先写到内存再一次性落盘，其他 worker 不会读到写了一半的文件
+        buffer = io.BytesIO()
+        if image_format == 'JPEG':
+            img.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        elif image_format == 'WEBP':
+            img.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+        else:
+            img.save(buffer, 'PNG', optimize=True)
+        path = os.path.join(self.folder, filename)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+
+def image_sources(resort, size='card'):
+    """
+    模板全局函数：度假村图片的 src / srcset
+
+    size 为 'card' 时提供 card 与 card_2x，'detail' 时提供全部尺寸。
+    变体尚未生成时退回原图。
+
+    Returns:
+        {'src': ..., 'srcset': ..., 'webp_srcset': ...}，没有图片时返回 None
+    """
+    if not resort.picture_local_address:
+        return None
+    variants = resort.picture_variants or {}
+    names = ['card', 'card_2x'] if size == 'card' else list(VARIANT_WIDTHS)
+    chosen = [variants[name] for name in names if name in variants]
+    if not chosen:
+        src = url_for('static', filename=resort.picture_local_address)
+        return {'src': src, 'srcset': None, 'webp_srcset': None}
+    srcset = ', '.join(f"{url_for('static', filename=v['path'])} {v['width']}w" for v in chosen)
+    webp_srcset = None
+    if all('webp' in v for v in chosen):
+        webp_srcset = ', '.join(f"{url_for('static', filename=v['webp'])} {v['width']}w" for v in chosen)
+    # 不支持 srcset 的浏览器：卡片用最小的图，详情页用最大的图
+    fallback = chosen[0] if size == 'card' else chosen[-1]
+    return {
+        'src': url_for('static', filename=fallback['path']),
+        'srcset': srcset,
+        'webp_srcset': webp_srcset,
+    }
+
+
+@images_cli.command('backfill')
+def backfill_command():
+    """为还没有变体的已有图片计算哈希并同步生成变体"""
+    pipeline = current_app.extensions['image_pipeline']
+    resorts = Resort.query.filter(
+        Resort.picture_local_address.isnot(None),
+        Resort.picture_variants.is_(None)
+    ).all()
+    processed = 0
+    for resort in resorts:
+        source = os.path.join(pipeline.folder, os.path.basename(resort.picture_local_address))
+        if not os.path.exists(source):
+            click.echo(f"resort {resort.id}: 找不到图片 {source}")
+            continue
+        with open(source, 'rb') as f:
+            resort.picture_hash = hashlib.sha256(f.read()).hexdigest()
+        db.session.commit()
+        if pipeline._run(resort.picture_local_address, resort.picture_hash, None):
+            processed += 1
+    click.echo(f"已处理 {processed}/{len(resorts)} 个度假村的图片")
+
+
+@images_cli.command('strip-metadata')
+def strip_metadata_command():
+    """去掉已保存原图中的 EXIF 等元数据（此前的版本按原样保存上传的图片）"""
+    pipeline = current_app.extensions['image_pipeline']
+    paths = {row[0] for row in db.session.query(Resort.picture_local_address).filter(
+        Resort.picture_local_address.isnot(None))}
+    stripped = 0
+    for picture in sorted(paths):
+        source = os.path.join(pipeline.folder, os.path.basename(picture))
+        try:
+            with open(source, 'rb') as f:
+                data = f.read()
+            cleaned = strip_metadata(data)
+        except (OSError, ValueError) as e:
+            click.echo(f"{source}: {e}")
+            continue
+        if cleaned != data:
+            with open(source + '.tmp', 'wb') as f:
+                f.write(cleaned)
+            os.replace(source + '.tmp', source)
+            stripped += 1
+    click.echo(f"已重写 {stripped}/{len(paths)} 张原图")
@@ -0,0 +1,347 @@
+"""
+预计算排行榜
+
+首页原来的排行直接按平均分排序：只有一条 10 分评论的度假村会排在 500 条评论平均 9.5 分的前面，
+也不考虑评论的新旧。这里用 NumPy 批量计算两种分数，把排好的名次写入 leaderboard_entry 表：
+
+- bayesian：贝叶斯平均 (C·m + 评分总和) / (C + 评分数)，m 为全站平均分，
+  C 为先验权重 LEADERBOARD_PRIOR_WEIGHT，评论少的度假村向全站平均收缩
+- trending：每条评论按 LEADERBOARD_HALF_LIFE_DAYS 半衰期衰减后的分数之和（没有评分的按 5 分计），
+  最近有大量好评的度假村排在前面
+
+每种分数各有全站、按国家、按 resort_type 三类榜单。`flask --app app leaderboards refresh`
+由 cron 定期执行，只读取上次之后的新评论：衰减权重相对固定的 epoch 保存，时间流逝对所有度假村
+是同一个系数，不需要重写；只有新评论所在的榜单需要重排，写入时也只更新名次发生变化的行。
+页面按 (board, rank) 主键读取一页，与榜单大小无关。
+"""
+import math
+import time
+from datetime import datetime
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.orm import contains_eager
+from setup_db import db, eastern, group_key, Resort, UserResort, LeaderboardEntry, ResortTrend, LeaderboardState
+from pagination import _pack, _unpack
+
+leaderboards_cli = AppGroup('leaderboards', help='预计算排行榜')
+
+ORDERS = ('bayesian', 'trending')
+# 没有评分的评论在 trending 中按这个分数计入
+NEUTRAL_RATING = 5
+# epoch 之后超过这么多个半衰期就整体重算一次，避免权重过大
+REBASE_HALF_LIVES = 64
+
+
+def board_name(order, country=None, resort_type=None):
+    """
+    榜单名：'bayesian:global'、'trending:country:japan'、'bayesian:type:beach'
+
+    国家和类型是自由填写的文本，用 group_key() 归一化：board 列在 MySQL 上不区分大小写，
+    "Japan" 和 "japan " 如果是两个榜单，写入时主键 (board, rank) 会冲突
+    """
+    country, resort_type = group_key(country), group_key(resort_type)
+    if country:
+        return f'{order}:country:{country}'
+    if resort_type:
+        return f'{order}:type:{resort_type}'
+    return f'{order}:global'
+
+
+def _now():
+    # 与 created_at 的默认值一致：美东时间，不带时区
+    return datetime.now(eastern).replace(tzinfo=None)
+
+
+def _settings():
+    config = current_app.config
+    return (
+        float(config.get('LEADERBOARD_PRIOR_WEIGHT', 10)),
+        float(config.get('LEADERBOARD_HALF_LIFE_DAYS', 7)) * 86400,
+        float(config.get('LEADERBOARD_PRIOR_TOLERANCE', 0.05)),
+    )
+
+
+def bayesian_scores(counts, sums, prior_weight, prior_mean):
+    """没有评分的度假村返回 NaN，排在榜单最后"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = (prior_weight * prior_mean + sums) / (prior_weight + counts)
+    scores[counts == 0] = np.nan
+    return scores
+
+
+def review_weights(ids, rows, epoch, half_life):
+    """
+    把评论折算成相对 epoch 的衰减权重，并按度假村累加
+
+    Args:
+        ids: 升序排列的度假村 id
+        rows: [(resort_id, created_at, recommendation), ...]
+
+    Returns:
+        (每个度假村的权重之和, 每个度假村的评论数)，与 ids 对齐
+    """
+    weights = np.zeros(len(ids))
+    counts = np.zeros(len(ids), dtype=np.int64)
+    if not rows or not len(ids):
+        return weights, counts
+    resort_ids, created, ratings = zip(*rows)
+    resort_ids = np.array(resort_ids, dtype=np.int64)
+    created = np.array([value or epoch for value in created], dtype='datetime64[us]')
+    ratings = np.array([NEUTRAL_RATING if value is None else value for value in ratings], dtype=np.float64)
+    seconds = (created - np.datetime64(epoch, 'us')).astype(np.float64) / 1e6
+    contributions = np.exp2(seconds / half_life) * ratings / 10
+    positions = np.minimum(np.searchsorted(ids, resort_ids), len(ids) - 1)
+    known = ids[positions] == resort_ids
+    weights += np.bincount(positions[known], weights=contributions[known], minlength=len(ids))
+    counts += np.bincount(positions[known], minlength=len(ids))
+    return weights, counts
+
+
+def _ranked_segments(ids, scores, values=None):
+    """
+    按分数降序、id 降序排名；没有分数的排在最后
+
+    Yields:
+        (分段取值或 None, 该段按名次排列的下标)
+    """
+    key = np.where(np.isnan(scores), -np.inf, scores)
+    if values is None:
+        yield None, np.lexsort((-ids, -key))
+        return
+    uniques, codes = np.unique(values, return_inverse=True)
+    order = np.lexsort((-ids, -key, codes))
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    for code, value in enumerate(uniques):
+        if value:
+            yield value, order[bounds[code]:bounds[code + 1]]
+
+
+def compute_boards(resorts, scores_by_order, wanted=None):
+    """
+    Yields:
+        (榜单名, 按名次排列的度假村 id, 对应分数)；wanted(榜单名) 为假的榜单跳过
+    """
+    ids = resorts['ids']
+    for order, scores in scores_by_order.items():
+        for scope, values in (('global', None), ('country', resorts['country']), ('type', resorts['resort_type'])):
+            for value, index in _ranked_segments(ids, scores, values):
+                name = f'{order}:global' if value is None else f'{order}:{scope}:{value}'
+                if wanted is None or wanted(name):
+                    yield name, ids[index], scores[index]
+
+
+def _same_score(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= 1e-9 * max(1.0, abs(a))
+
+
+def write_board(board, resort_ids, scores):
+    """只写入名次或分数发生变化的行，返回写入的行数"""
+    old = {rank: (resort_id, score) for rank, resort_id, score in db.session.execute(
+        db.select(LeaderboardEntry.rank, LeaderboardEntry.resort_id, LeaderboardEntry.score)
+        .where(LeaderboardEntry.board == board)
+    )}
+    inserts, updates = [], []
+    for rank, (resort_id, score) in enumerate(zip(resort_ids.tolist(), scores.tolist()), 1):
+        score = None if math.isnan(score) else score
+        row = {'board': board, 'rank': rank, 'resort_id': resort_id, 'score': score}
+        previous = old.pop(rank, None)
+        if previous is None:
+            inserts.append(row)
+        elif previous[0] != resort_id or not _same_score(previous[1], score):
+            updates.append(row)
+    if inserts:
+        db.session.execute(db.insert(LeaderboardEntry), inserts)
+    if updates:
+        db.session.bulk_update_mappings(LeaderboardEntry, updates)
+    if old:
+        db.session.execute(db.delete(LeaderboardEntry).where(
+            LeaderboardEntry.board == board, LeaderboardEntry.rank > len(resort_ids)
+        ))
+    return len(inserts) + len(updates) + len(old)
+
+
+def _load_resorts():
+    rows = db.session.execute(db.select(
+        Resort.id, Resort.country, Resort.resort_type, Resort.review_count, Resort.rating_count, Resort.rating_sum
+    ).order_by(Resort.id)).all()
+    ids, countries, types, reviews, counts, sums = zip(*rows) if rows else ((),) * 6
+    return {
+        'ids': np.array(ids, dtype=np.int64),
+        # 与 board_name 相同的归一化，大小写或空格不同的写法进入同一个榜单
+        'country': np.array([group_key(value) for value in countries], dtype=object),
+        'resort_type': np.array([group_key(value) for value in types], dtype=object),
+        'reviews': np.array(reviews, dtype=np.int64),
+        'rating_count': np.array(counts, dtype=np.float64),
+        'rating_sum': np.array(sums, dtype=np.float64),
+    }
+
+
+def _reviews(*conditions):
+    return db.session.execute(db.select(
+        UserResort.resort_id, UserResort.created_at, UserResort.recommendation
+    ).where(*conditions)).all()
+
+
+def refresh(full=False):
+    """
+    更新衰减权重并重排受影响的榜单
+
+    Returns:
+        {'mode': 'full' 或 'incremental', 'reviews': 读取的新评论数, 'boards': 重排的榜单数, 'rows': 写入的行数}
+    """
+    prior_weight, half_life, tolerance = _settings()
+    now = _now()
+    state = db.session.get(LeaderboardState, 1)
+    if state is None or (now - state.epoch).total_seconds() > REBASE_HALF_LIVES * half_life:
+        full = True
+    # 先定水位线，再读聚合：聚合只会比水位线新，不会漏掉评论
+    watermark = db.session.execute(db.select(db.func.max(UserResort.id))).scalar() or 0
+    resorts = _load_resorts()
+    ids = resorts['ids']
+
+    if full:
+        epoch = now
+        weights, counts = review_weights(ids, _reviews(UserResort.id <= watermark), epoch, half_life)
+        new_reviews = int(counts.sum())
+        affected = np.ones(len(ids), dtype=bool)
+    else:
+        epoch = state.epoch
+        trends = db.session.execute(db.select(ResortTrend.resort_id, ResortTrend.weight, ResortTrend.review_count)).all()
+        weights = np.zeros(len(ids))
+        counts = np.zeros(len(ids), dtype=np.int64)
+        if trends:
+            trend_ids, trend_weights, trend_counts = (np.array(column) for column in zip(*trends))
+            positions = np.searchsorted(ids, trend_ids)
+            known = positions < len(ids)
+            weights[positions[known]] = trend_weights[known]
+            counts[positions[known]] = trend_counts[known]
+        added_weights, added_counts = review_weights(
+            ids, _reviews(UserResort.id > state.last_review_id, UserResort.id <= watermark), epoch, half_life
+        )
+        weights += added_weights
+        counts += added_counts
+        new_reviews = int(added_counts.sum())
+        affected = (added_counts > 0) | (ids > state.last_resort_id)
+        # 事务提交顺序与自增 id 不一致时，个别评论会落在水位线以下而被跳过；
+        # 这些度假村的评论数对不上，按水位线以内的全部评论重算
+        missing = counts < resorts['reviews']
+        if missing.any():
+            repaired_weights, repaired_counts = review_weights(ids, _reviews(
+                UserResort.resort_id.in_(ids[missing].tolist()), UserResort.id <= watermark
+            ), epoch, half_life)
+            repaired = missing & (repaired_counts != counts)
+            weights[repaired] = repaired_weights[repaired]
+            counts[repaired] = repaired_counts[repaired]
+            affected |= repaired
+
+    total_count = resorts['rating_count'].sum()
+    prior_mean = resorts['rating_sum'].sum() / total_count if total_count else 0.0
+    prior_changed = full or state.prior_mean is None or abs(prior_mean - state.prior_mean) > tolerance
+    if not prior_changed:
+        prior_mean = state.prior_mean
+    scores = {
+        'bayesian': bayesian_scores(resorts['rating_count'], resorts['rating_sum'], prior_weight, prior_mean),
+        'trending': np.where(counts > 0, weights, np.nan),
+    }
+
+    wanted = None
+    if not full:
+        touched = set()
+        if affected.any():
+            touched.add('global')
+            touched.update(f'country:{value}' for value in set(resorts['country'][affected]) if value)
+            touched.update(f'type:{value}' for value in set(resorts['resort_type'][affected]) if value)
+
+        # 全站平均分变化较大时所有 bayesian 榜单都要重排；trending 只重排有新评论的榜单
+        def wanted(name):
+            order, scope = name.split(':', 1)
+            return scope in touched or (order == 'bayesian' and prior_changed)
+
+    boards = rows = 0
+    if full:
+        db.session.execute(db.delete(LeaderboardEntry))
+    for name, board_ids, board_scores in compute_boards(resorts, scores, wanted):
+        rows += write_board(name, board_ids, board_scores)
+        boards += 1
+
+    changed = np.flatnonzero(affected)
+    if full:
+        db.session.execute(db.delete(ResortTrend))
+    trend_rows = [{'resort_id': int(ids[i]), 'weight': float(weights[i]), 'review_count': int(counts[i])}
+                  for i in changed if counts[i] > 0]
+    if full:
+        if trend_rows:
+            db.session.execute(db.insert(ResortTrend), trend_rows)
+    else:
+        existing = {row[0] for row in db.session.execute(
+            db.select(ResortTrend.resort_id).where(ResortTrend.resort_id.in_([row['resort_id'] for row in trend_rows]))
+        )} if trend_rows else set()
+        if existing:
+            db.session.bulk_update_mappings(ResortTrend, [row for row in trend_rows if row['resort_id'] in existing])
+        inserts = [row for row in trend_rows if row['resort_id'] not in existing]
+        if inserts:
+            db.session.execute(db.insert(ResortTrend), inserts)
+
+    if state is None:
+        state = LeaderboardState(id=1)
+        db.session.add(state)
+    state.last_review_id = watermark
+    state.last_resort_id = int(ids.max()) if len(ids) else 0
+    state.epoch = epoch
+    state.refreshed_at = now
+    state.prior_mean = prior_mean
+    db.session.commit()
+    return {'mode': 'full' if full else 'incremental', 'reviews': new_reviews, 'boards': boards, 'rows': rows}
+
+
+def leaderboard_page(board, cursor, limit, offset=0):
+    """
+    按名次读取榜单的一页；没有游标时从第 offset 名之后开始
+
+    Returns:
+        ([(Resort, 名次, 分数), ...], 下一页游标)，没有更多数据时游标为 None
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    query = LeaderboardEntry.query.join(LeaderboardEntry.resort).options(
+        contains_eager(LeaderboardEntry.resort)
+    ).filter(LeaderboardEntry.board == board)
+    if cursor:
+        # 游标记录 (榜单名, 上一页最后的名次)，拿别的榜单的游标翻页视为无效
+        cursor_board, rank = _unpack(cursor)
+        if cursor_board != board:
+            raise ValueError(f"无效的游标: {cursor}")
+        query = query.filter(LeaderboardEntry.rank > rank)
+    elif offset:
+        query = query.filter(LeaderboardEntry.rank > offset)
+    entries = query.order_by(LeaderboardEntry.rank).limit(limit + 1).all()
+    page = entries[:limit]
+    scale = 1.0
+    if board.startswith('trending:') and page:
+        # trending 的分数相对 epoch 保存，换算成最近一次刷新时的衰减值
+        state = db.session.get(LeaderboardState, 1)
+        if state is not None:
+            scale = 2 ** (-(state.refreshed_at - state.epoch).total_seconds() / _settings()[1])
+    items = [(entry.resort, entry.rank, None if entry.score is None else round(entry.score * scale, 4))
+             for entry in page]
+    next_cursor = _pack([board, page[-1].rank]) if len(entries) > limit else None
+    return items, next_cursor
+
+
+@leaderboards_cli.command('refresh')
+@click.option('--full', is_flag=True, help='忽略上次的结果，从全部评论重新计算')
+def refresh_command(full):
+    """增量更新 bayesian / trending 排行榜（建议由 cron 每分钟执行）"""
+    start = time.perf_counter()
+    result = refresh(full)
+    response_cache = current_app.extensions.get('response_cache')
+    if response_cache is not None and result['rows']:
+        # CLI 与 web worker 不在同一个进程，通过 cache_tag 表通知它们
+        response_cache.invalidate('ranking', shared=True)
+    click.echo(f"{result['mode']}：读取 {result['reviews']} 条新评论，重排 {result['boards']} 个榜单，"
+               f"写入 {result['rows']} 行，耗时 {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,209 @@
+"""
+请求级性能指标
+
+通过 Flask 请求钩子、模板渲染信号和 SQLAlchemy 引擎事件，按路由（endpoint）统计：
+请求耗时直方图、SQL 条数、数据库耗时、增删改影响的行数和模板渲染耗时，
+并在 /metrics 以 Prometheus 文本格式输出。
+
+每个请求只做几次 perf_counter 和字典累加，开销很小，可以在生产环境常开。
+指标保存在进程内存中，多个 gunicorn worker 各自统计，由 Prometheus 分别抓取。
+"""
+import threading
+import time
+from flask import g, request, has_request_context, before_render_template, template_rendered, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 请求耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 慢请求日志中最多记录的 SQL 条数
+SLOW_LOG_MAX_STATEMENTS = 50
+
+
+class RouteStats:
+    """单个路由的累计指标"""
+
+    __slots__ = ('buckets', 'count', 'duration', 'statements', 'db_time', 'affected_rows', 'render_time', 'errors')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.statements = 0
+        self.db_time = 0.0
+        self.affected_rows = 0
+        self.render_time = 0.0
+        self.errors = 0
+
+
+class Metrics:
+    """收集每个请求的性能数据并汇总到各路由"""
+
+    def __init__(self, app=None):
+        self.routes = {}
+        self.collectors = []
+        self.slow_request_ms = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        METRICS_SLOW_REQUEST_MS: 超过该毫秒数的请求连同其 SQL 写入日志，0 表示关闭
+        """
+        self.slow_request_ms = float(app.config.get('METRICS_SLOW_REQUEST_MS', 0) or 0)
+        self.logger = app.logger
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        # 监听所有引擎，读写分离等场景下新建的引擎也会被统计
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+        app.extensions['metrics'] = self
+
+    def add_collector(self, collector):
+        """注册额外的指标来源：collector() 返回 [(指标名, 帮助文本, 类型, 值), ...]"""
+        self.collectors.append(collector)
+
+    def _before_request(self):
+        g.metrics = {
+            'start': time.perf_counter(),
+            'statements': 0,
+            'db_time': 0.0,
+            'affected_rows': 0,
+            'render_time': 0.0,
+            'render_depth': 0,
+            'render_start': 0.0,
+            'sql': [] if self.slow_request_ms else None,
+        }
+
+    def _before_render(self, sender, template, context, **extra):
+        state = g.get('metrics')
+        if state is None:
+            return
+        if state['render_depth'] == 0:
+            state['render_start'] = time.perf_counter()
+        state['render_depth'] += 1
+
+    def _after_render(self, sender, template, context, **extra):
+        state = g.get('metrics')
+        if state is None or state['render_depth'] == 0:
+            return
+        state['render_depth'] -= 1
+        # 模板里嵌套渲染的片段已包含在外层耗时中，只统计最外层
+        if state['render_depth'] == 0:
+            state['render_time'] += time.perf_counter() - state['render_start']
+
+    def _teardown_request(self, exc):
+        state = g.pop('metrics', None)
+        if state is None:
+            return
+        duration = time.perf_counter() - state['start']
+        route = request.endpoint or 'unmatched'
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.count += 1
+            stats.duration += duration
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+            stats.statements += state['statements']
+            stats.db_time += state['db_time']
+            stats.affected_rows += state['affected_rows']
+            stats.render_time += state['render_time']
+            if exc is not None:
+                stats.errors += 1
+        if self.slow_request_ms and duration * 1000 >= self.slow_request_ms:
+            self._log_slow_request(route, duration, state)
+
+    def _log_slow_request(self, route, duration, state):
+        lines = [
+            f"慢请求 {request.method} {request.path} ({route}) 耗时 {duration * 1000:.1f}ms，"
+            f"SQL {state['statements']} 条共 {state['db_time'] * 1000:.1f}ms，"
+            f"模板渲染 {state['render_time'] * 1000:.1f}ms"
+        ]
+        for elapsed, statement in sorted(state['sql'], key=lambda item: -item[0]):
+            lines.append(f"  {elapsed * 1000:8.2f}ms  {' '.join(statement.split())}")
+        self.logger.warning('\n'.join(lines))
+
+    def render(self):
+        """生成 Prometheus 文本格式的指标"""
+        out = []
+        with self._lock:
+            routes = sorted(self.routes.items())
+            out.append('# HELP travelhub_request_duration_seconds Request latency by route.')
+            out.append('# TYPE travelhub_request_duration_seconds histogram')
+            for route, stats in routes:
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    out.append(f'travelhub_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {count}')
+                out.append(f'travelhub_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {stats.count}')
+                out.append(f'travelhub_request_duration_seconds_sum{{route="{route}"}} {stats.duration:.6f}')
+                out.append(f'travelhub_request_duration_seconds_count{{route="{route}"}} {stats.count}')
+            counters = (
+                ('travelhub_request_errors_total', 'Requests that raised an exception.', 'errors', '{}'),
+                ('travelhub_sql_statements_total', 'SQL statements executed.', 'statements', '{}'),
+                ('travelhub_db_seconds_total', 'Time spent executing SQL.', 'db_time', '{:.6f}'),
+                ('travelhub_db_affected_rows_total', 'Rows changed by INSERT, UPDATE and DELETE statements (SELECT results are not counted).',
+                 'affected_rows', '{}'),
+                ('travelhub_template_render_seconds_total', 'Time spent rendering templates.', 'render_time', '{:.6f}'),
+            )
+            for name, help_text, attr, fmt in counters:
+                out.append(f'# HELP {name} {help_text}')
+                out.append(f'# TYPE {name} counter')
+                for route, stats in routes:
+                    out.append(f'{name}{{route="{route}"}} {fmt.format(getattr(stats, attr))}')
+        for collector in self.collectors:
+            for name, help_text, metric_type, value in collector():
+                out.append(f'# HELP {name} {help_text}')
+                out.append(f'# TYPE {name} {metric_type}')
+                out.append(f'{name} {value}')
+        return '\n'.join(out) + '\n'
+
+    def response(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics' in g:
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts or not has_request_context():
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    state = g.get('metrics')
+    if state is None:
+        return
+    state['statements'] += 1
+    state['db_time'] += elapsed
+    # SELECT 的 rowcount 在 SQLite 和 MySQL 非缓冲游标上是 -1，只有增删改的影响行数可靠
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+        state['affected_rows'] += cursor.rowcount
+    if state['sql'] is not None and len(state['sql']) < SLOW_LOG_MAX_STATEMENTS:
+        state['sql'].append((elapsed, statement))
+
+
+def _handle_error(exception_context):
+    # 出错的语句不会触发 after_cursor_execute，取出它的开始时间，否则留在连接池的连接上，
+    # 之后的查询会配上错误的开始时间
+    conn = exception_context.connection
+    if conn is None or exception_context.statement is None:
+        return
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    state = g.get('metrics') if has_request_context() else None
+    if state is None:
+        return
+    state['statements'] += 1
+    state['db_time'] += elapsed
+    if state['sql'] is not None and len(state['sql']) < SLOW_LOG_MAX_STATEMENTS:
+        state['sql'].append((elapsed, exception_context.statement))
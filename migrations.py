@@ -0,0 +1,308 @@
+"""
+数据库结构迁移
+
+db.create_all() 只会创建缺失的表，不会给已有的表加列或索引。
+这里按版本号登记每一次结构变更，`flask --app app schema upgrade` 依次执行尚未执行的版本，
+执行过的版本记录在 schema_migrations 表中。每个迁移在修改前都会检查列或索引是否已经存在，
+在 create_all 新建的数据库上执行时只会登记版本号。
+应用启动时不做任何建表工作，部署时先运行 `schema bootstrap`（建表、迁移、创建管理员账户）。
+
+`schema check` 对热点查询执行 EXPLAIN，某个查询没有用上预期的索引时以非零状态退出，
+可以放在部署流程里，防止改动查询或索引后悄悄退化成全表扫描。
+"""
+import re
+from datetime import datetime
+import click
+import sqlalchemy as sa
+from flask.cli import AppGroup
+from setup_db import (db, User, Resort, UserResort, LeaderboardEntry, ResortTrend, LeaderboardState,
+                      UserRecommendation, SimilarResort, ImportCheckpoint, StatsRollup, StatsState, CacheTag,
+                      create_admin, initialize_database)
+from ratings import rebuild_aggregates
+from pagination import ranked_resorts, resort_reviews, created_resorts, user_reviews
+
+schema_cli = AppGroup('schema', help='数据库结构迁移与索引检查')
+
+schema_migrations = sa.Table(
+    'schema_migrations', sa.MetaData(),
+    sa.Column('version', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('description', sa.String(200), nullable=False),
+    sa.Column('applied_at', sa.DateTime, nullable=False),
+)
+
+# [(版本号, 说明, 迁移函数)]，按版本号顺序执行
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """登记一个迁移，函数接收 SchemaEditor"""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return fn
+    return decorator
+
+
+class SchemaEditor:
+    """按模型中的定义补齐列和索引，已经存在的跳过"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.changed = []
+
+    def has_column(self, table_name, column_name):
+        columns = sa.inspect(self.connection).get_columns(table_name)
+        return column_name in {column['name'] for column in columns}
+
+    def has_index(self, table_name, index_name):
+        indexes = sa.inspect(self.connection).get_indexes(table_name)
+        return index_name in {index['name'] for index in indexes}
+
+    def add_column(self, model, column_name):
+        table = model.__table__
+        if self.has_column(table.name, column_name):
+            return False
+        column = table.c[column_name]
+        preparer = self.connection.dialect.identifier_preparer
+        ddl = sa.schema.CreateColumn(column).compile(dialect=self.connection.dialect)
+        ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"
+        if not column.nullable and column.default is not None and column.default.is_scalar:
+            # 已有的行需要一个默认值才能加 NOT NULL 列
+            ddl += f" DEFAULT {column.default.arg}"
+        self.connection.exec_driver_sql(ddl)
+        self.changed.append(f"{table.name}.{column_name}")
+        return True
+
+    def create_table(self, model):
+        table = model.__table__
+        if sa.inspect(self.connection).has_table(table.name):
+            return False
+        table.create(self.connection)
+        self.changed.append(table.name)
+        return True
+
+    def create_index(self, model, index_name):
+        table = model.__table__
+        if self.has_index(table.name, index_name):
+            return False
+        index = next(index for index in table.indexes if index.name == index_name)
+        index.create(self.connection)
+        self.changed.append(index_name)
+        return True
+
+
+@migration(1, 'resort rating aggregates and ranking index')
+def add_rating_aggregates(schema):
+    added = [
+        schema.add_column(Resort, name)
+        for name in ('review_count', 'rating_count', 'rating_sum', 'avg_score', 'expenditure_count',
+                     'expenditure_sum', 'expenditure_min', 'expenditure_max')
+    ]
+    schema.create_index(Resort, 'ix_resort_avg_score_id')
+    if any(added):
+        # 新加的聚合列都是 0，用 user_resort 重新计算一次
+        rebuild_aggregates()
+
+
+@migration(2, 'resort picture hash and variants')
+def add_picture_variants(schema):
+    schema.add_column(Resort, 'picture_hash')
+    schema.add_column(Resort, 'picture_variants')
+    schema.create_index(Resort, 'ix_resort_picture_hash')
+
+
+@migration(3, 'resort search and facet indexes')
+def add_search_indexes(schema):
+    for name in ('ix_resort_location', 'ix_resort_country_rank', 'ix_resort_type_rank',
+                 'ix_resort_name_city_fulltext'):
+        schema.create_index(Resort, name)
+
+
+@migration(4, 'review and creator lookup indexes')
+def add_lookup_indexes(schema):
+    schema.create_index(UserResort, 'ix_user_resort_resort_created')
+    schema.create_index(UserResort, 'ix_user_resort_user_created')
+    schema.create_index(Resort, 'ix_resort_creator_id')
+
+
+@migration(5, 'precomputed leaderboards')
+def add_leaderboards(schema):
+    for model in (LeaderboardEntry, ResortTrend, LeaderboardState):
+        schema.create_table(model)
+
+
+@migration(6, 'recommendation tables')
+def add_recommendations(schema):
+    for model in (UserRecommendation, SimilarResort):
+        schema.create_table(model)
+
+
+@migration(7, 'bulk import checkpoints')
+def add_import_checkpoints(schema):
+    schema.create_table(ImportCheckpoint)
+
+
+@migration(8, 'geographic and resort_type rollups')
+def add_stats_rollups(schema):
+    for model in (StatsRollup, StatsState):
+        schema.create_table(model)
+
+
+@migration(9, 'user contribution counters')
+def add_user_counters(schema):
+    added = [
+        schema.add_column(User, name)
+        for name in ('resort_count', 'review_count', 'rating_count', 'rating_sum', 'expenditure_count',
+                     'expenditure_sum')
+    ]
+    if any(added):
+        # 新加的计数列都是 0，从 resort 和 user_resort 重新统计一次
+        rebuild_aggregates(model=User)
+
+
+@migration(10, 'case-insensitive rollup keys')
+def normalize_rollup_keys(schema):
+    schema.add_column(StatsRollup, 'label')
+    # 旧的键区分大小写，删除水位线让下一次 stats refresh 全量重算
+    schema.connection.execute(sa.delete(StatsState.__table__))
+
+
+@migration(11, 'case-insensitive leaderboard names')
+def normalize_leaderboard_names(schema):
+    # 旧的榜单名区分大小写，删除状态行让下一次 leaderboards refresh 全量重算
+    schema.connection.execute(sa.delete(LeaderboardState.__table__))
+
+
+@migration(12, 'shared cache tag versions')
+def add_cache_tags(schema):
+    schema.create_table(CacheTag)
+
+
+def applied_versions():
+    connection = db.session.connection()
+    schema_migrations.create(connection, checkfirst=True)
+    return {row.version for row in connection.execute(sa.select(schema_migrations.c.version))}
+
+
+def upgrade(target=None):
+    """
+    创建缺失的表并执行尚未执行的迁移
+
+    Returns:
+        [(版本号, 说明, 修改过的列和索引)]
+    """
+    db.create_all()
+    applied = applied_versions()
+    db.session.commit()
+    done = []
+    for version, description, fn in MIGRATIONS:
+        if version in applied or (target is not None and version > target):
+            continue
+        schema = SchemaEditor(db.session.connection())
+        fn(schema)
+        db.session.execute(schema_migrations.insert().values(
+            version=version, description=description, applied_at=datetime.now()
+        ))
+        db.session.commit()
+        done.append((version, description, schema.changed))
+    return done
+
+
+def hot_queries():
+    """
+    需要走索引的热点查询
+
+    Returns:
+        [(名称, 查询, 期望使用的索引)]
+    """
+    sample = db.session.query(Resort.id, Resort.country, Resort.creator_id).first()
+    resort_id, country, creator_id = sample if sample else (1, 'China', 1)
+    user_id = creator_id or 1
+    return [
+        ('home ranking', ranked_resorts().limit(20), 'ix_resort_avg_score_id'),
+        ('ranking by country', ranked_resorts().filter(Resort.country == country).limit(20),
+         'ix_resort_country_rank'),
+        ('resort reviews', resort_reviews(resort_id).limit(21), 'ix_user_resort_resort_created'),
+        ('profile resorts', created_resorts(user_id).limit(21), 'ix_resort_creator_id'),
+        ('profile reviews', user_reviews(user_id).limit(21), 'ix_user_resort_user_created'),
+        ('stats children', StatsRollup.query.filter_by(dimension='geo', parent='[]').order_by(
+            StatsRollup.review_count.desc(), StatsRollup.key
+        ).limit(100), 'ix_stats_rollup_parent'),
+    ]
+
+
+def explain(query):
+    """
+    Returns:
+        (查询计划用到的索引名集合, 可读的查询计划行)
+    """
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    connection = db.session.connection()
+    if dialect.name == 'mysql':
+        rows = connection.exec_driver_sql('EXPLAIN ' + sql).mappings().all()
+        used = {row['key'] for row in rows if row['key']}
+        plan = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row['Extra'] or ''}"
+                for row in rows]
+    elif dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+        used = set(re.findall(r'USING (?:COVERING )?INDEX (\w+)', '\n'.join(plan)))
+    elif dialect.name == 'postgresql':
+        plan = [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + sql)]
+        used = set(re.findall(r'Index (?:Only )?Scan(?: Backward)? using (\w+)', '\n'.join(plan)))
+    else:
+        raise click.ClickException(f"不支持对 {dialect.name} 执行 EXPLAIN 检查")
+    return used, plan
+
+
+@schema_cli.command('upgrade')
+@click.option('--target', type=int, help='只升级到指定版本')
+def upgrade_command(target):
+    """创建缺失的表并执行尚未执行的迁移"""
+    done = upgrade(target)
+    for version, description, changed in done:
+        click.echo(f"{version:04d} {description}: {', '.join(changed) or '无需修改'}")
+    click.echo(f"执行了 {len(done)} 个迁移" if done else "数据库结构已是最新")
+
+
+@schema_cli.command('bootstrap')
+@click.option('--create-database', is_flag=True, help='先用 MySQL root 账户创建数据库（DB_NAME）')
+def bootstrap_command(create_database):
+    """部署时执行一次：建表、执行迁移并创建管理员账户"""
+    if create_database:
+        initialize_database()
+    done = upgrade()
+    click.echo(f"执行了 {len(done)} 个迁移" if done else "数据库结构已是最新")
+    if create_admin():
+        click.echo("已成功创建管理员账户。")
+
+
+@schema_cli.command('status')
+def status_command():
+    """列出各迁移的执行状态"""
+    applied = applied_versions()
+    for version, description, _ in MIGRATIONS:
+        click.echo(f"{version:04d} {'已执行' if version in applied else '未执行'}  {description}")
+
+
+@schema_cli.command('check')
+@click.option('--verbose', '-v', is_flag=True, help='输出完整的查询计划')
+def check_command(verbose):
+    """EXPLAIN 热点查询，没有使用预期索引时以非零状态退出"""
+    applied = applied_versions()
+    pending = [version for version, _, _ in MIGRATIONS if version not in applied]
+    if pending:
+        click.echo(f"有 {len(pending)} 个迁移尚未执行，请先运行 schema upgrade")
+        raise SystemExit(1)
+    failed = 0
+    for name, query, index in hot_queries():
+        used, plan = explain(query)
+        ok = index in used
+        failed += not ok
+        click.echo(f"[{'OK' if ok else 'FAIL'}] {name}: 期望 {index}，实际 {', '.join(sorted(used)) or '未使用索引'}")
+        if verbose or not ok:
+            for line in plan:
+                click.echo(f"    {line}")
+    if failed:
+        click.echo(f"{failed} 个热点查询没有使用预期的索引")
+        raise SystemExit(1)
@@ -0,0 +1,183 @@
+"""
+游标（keyset）分页
+
+- 度假村排行：avg_score DESC, id DESC（没有评分的度假村排在最后）
+- 度假村评论、用户提交的评论：created_at DESC, id DESC
+- 用户提交的度假村：id DESC
+
+游标把上一页最后一条的排序键编码成不透明字符串，
+下一页直接从索引上的该位置继续读取，不需要像 OFFSET 那样重新排序并丢弃前面的行，
+翻页期间数据发生变化也不会出现重复或遗漏。
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy.orm import contains_eager
+from setup_db import db, User, Resort, UserResort
+
+
+def ranked_resorts():
+    """按平均评分从高到低排列的度假村查询，评分相同时按 id 倒序保证顺序稳定"""
+    return Resort.query.order_by(Resort.avg_score.desc(), Resort.id.desc())
+
+
+def _pack(values):
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _unpack(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError(f"无效的游标: {cursor}") from e
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError(f"无效的游标: {cursor}")
+    return values
+
+
+def encode_cursor(resort):
+    """把度假村在排行中的位置编码成游标字符串"""
+    return _pack([resort.avg_score, resort.id])
+
+
+def decode_cursor(cursor):
+    """
+    解析游标字符串
+
+    Returns:
+        (avg_score, id)，avg_score 可能为 None
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    avg_score, resort_id = _unpack(cursor)
+    if not (avg_score is None or isinstance(avg_score, (int, float))):
+        raise ValueError(f"无效的游标: {cursor}")
+    return avg_score, resort_id
+
+
+def keyset_page(query, cursor, limit):
+    """
+    在按 avg_score DESC, id DESC 排序的查询上读取游标之后的一页
+
+    有评分的部分和没有评分（NULL）的部分分两段查询，
+    每段都是索引上的一个连续区间，可以直接定位起点而不用从头扫描。
+
+    Returns:
+        (本页度假村列表, 下一页游标)，没有更多数据时游标为 None
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    # 多取一条用来判断是否还有下一页
+    wanted = limit + 1
+    if not cursor:
+        rows = query.limit(wanted).all()
+    else:
+        avg_score, resort_id = decode_cursor(cursor)
+        if avg_score is None:
+            rows = query.filter(Resort.avg_score.is_(None), Resort.id < resort_id).limit(wanted).all()
+        else:
+            rows = query.filter(
+                Resort.avg_score <= avg_score,
+                db.or_(Resort.avg_score < avg_score, Resort.id < resort_id)
+            ).limit(wanted).all()
+            if len(rows) < wanted:
+                rows += query.filter(Resort.avg_score.is_(None)).limit(wanted - len(rows)).all()
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def resort_reviews(resort_id):
+    """
+    某个度假村的评论，按时间倒序
+
+    作者在同一条 SQL 里 JOIN 进来（contains_eager），模板访问 ur.user 不会再逐条查询
+    """
+    return UserResort.query.join(UserResort.user).options(
+        contains_eager(UserResort.user)
+    ).filter(UserResort.resort_id == resort_id).order_by(
+        UserResort.created_at.desc(), UserResort.id.desc()
+    )
+
+
+def review_page(resort_id, cursor, limit):
+    """
+    读取度假村评论的一页
+
+    Returns:
+        (本页 UserResort 列表, 下一页游标)，没有更多数据时游标为 None
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    return _review_page(resort_reviews(resort_id), cursor, limit)
+
+
+def user_reviews(user_id):
+    """
+    某个用户提交的评论，按时间倒序，走 ix_user_resort_user_created
+
+    度假村在同一条 SQL 里 JOIN 进来，模板访问 ur.resort 不会再逐条查询
+    """
+    return UserResort.query.join(UserResort.resort).options(
+        contains_eager(UserResort.resort)
+    ).filter(UserResort.user_id == user_id).order_by(
+        UserResort.created_at.desc(), UserResort.id.desc()
+    )
+
+
+def user_review_page(user_id, cursor, limit):
+    """读取用户提交的评论的一页，返回值与 review_page 相同"""
+    return _review_page(user_reviews(user_id), cursor, limit)
+
+
+def _review_page(query, cursor, limit):
+    if cursor:
+        created_at, review_id = _unpack(cursor)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"无效的游标: {cursor}") from e
+        query = query.filter(
+            UserResort.created_at <= created_at,
+            db.or_(UserResort.created_at < created_at, UserResort.id < review_id)
+        )
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _pack([page[-1].created_at.isoformat(), page[-1].id])
+    return page, next_cursor
+
+
+def created_resorts(user_id):
+    """某个用户提交的度假村，新提交的在前，走 ix_resort_creator_id"""
+    return Resort.query.filter(Resort.creator_id == user_id).order_by(Resort.id.desc())
+
+
+def created_resort_page(user_id, cursor, limit):
+    """
+    读取用户提交的度假村的一页
+
+    Returns:
+        (本页 Resort 列表, 下一页游标)，没有更多数据时游标为 None
+
+    Raises:
+        ValueError: 游标格式不正确，或属于别的用户
+    """
+    query = created_resorts(user_id)
+    if cursor:
+        # 游标记录 (用户 id, 上一页最后的度假村 id)
+        cursor_user, resort_id = _unpack(cursor)
+        if cursor_user != user_id:
+            raise ValueError(f"无效的游标: {cursor}")
+        query = query.filter(Resort.id < resort_id)
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = _pack([user_id, page[-1].id]) if len(rows) > limit else None
+    return page, next_cursor
@@ -0,0 +1,278 @@
+"""
+度假村评分聚合
+
+Resort 表上保存了每个度假村的评论数、评分数/总分/平均分以及开销统计，
+新增 UserResort 时在同一个事务里增量更新，首页排行只需按 ix_resort_avg_score_id 索引读取。
+User 表上的贡献计数（提交的度假村数、评论数、打分和花费总和）也在写入时累加，个人页不必重新统计。
+rebuild / verify 命令用一次 GROUP BY 批量重算，用来初始化旧数据或检查漂移。
+"""
+import click
+from flask.cli import AppGroup
+from setup_db import db, Resort, User, UserResort
+
+ratings_cli = AppGroup('ratings', help='评分聚合的重建与校验')
+
+AGGREGATE_FIELDS = (
+    'review_count',
+    'rating_count',
+    'rating_sum',
+    'avg_score',
+    'expenditure_count',
+    'expenditure_sum',
+    'expenditure_min',
+    'expenditure_max',
+)
+
+USER_AGGREGATE_FIELDS = (
+    'resort_count',
+    'review_count',
+    'rating_count',
+    'rating_sum',
+    'expenditure_count',
+    'expenditure_sum',
+)
+
+
+def _average(total, count):
+    return round(total / count, 2) if count else None
+
+
+def record_review(resort_id, recommendation=None, expenditure=None):
+    """
+    把一条新的 UserResort 计入度假村的聚合字段
+
+    行级加锁（FOR UPDATE）后在 Python 中更新，保证并发提交时计数不丢失。
+    只修改 session 中的对象，由调用方和 UserResort 的插入一起 commit。
+    """
+    return record_reviews(resort_id, [(recommendation, expenditure)])
+
+
+def record_reviews(resort_id, reviews):
+    """
+    把同一个度假村的多条新评论一次计入聚合字段（批量写入时使用）
+
+    Args:
+        reviews: [(recommendation, expenditure), ...]
+    """
+    resort = db.session.get(Resort, resort_id, with_for_update=True, populate_existing=True)
+    if resort is None:
+        return None
+    _accumulate(resort, reviews)
+    return resort
+
+
+def record_reviews_many(by_resort):
+    """
+    把多个度假村的新评论计入聚合字段（批量导入使用）
+
+    一条 SELECT ... FOR UPDATE 按 id 顺序锁定全部度假村，修改在 flush 时批量 UPDATE。
+
+    Args:
+        by_resort: {resort_id: [(recommendation, expenditure), ...]}
+    """
+    resorts = Resort.query.filter(Resort.id.in_(list(by_resort))).order_by(Resort.id) \
+        .with_for_update().populate_existing().all()
+    for resort in resorts:
+        _accumulate(resort, by_resort[resort.id])
+    return resorts
+
+
+def _accumulate(resort, reviews):
+    for recommendation, expenditure in reviews:
+        resort.review_count = (resort.review_count or 0) + 1
+        if recommendation is not None:
+            resort.rating_count = (resort.rating_count or 0) + 1
+            resort.rating_sum = (resort.rating_sum or 0) + recommendation
+        if expenditure is not None:
+            resort.expenditure_count = (resort.expenditure_count or 0) + 1
+            resort.expenditure_sum = (resort.expenditure_sum or 0) + expenditure
+            if resort.expenditure_min is None or expenditure < resort.expenditure_min:
+                resort.expenditure_min = expenditure
+            if resort.expenditure_max is None or expenditure > resort.expenditure_max:
+                resort.expenditure_max = expenditure
+    resort.avg_score = _average(resort.rating_sum, resort.rating_count)
+
+
+def record_user_activity(reviews=None, resorts=None):
+    """
+    把新评论和新度假村计入作者的贡献计数
+
+    每个用户一条 UPDATE ... SET x = x + n，不需要先加锁读出旧值；按用户 id 顺序执行，
+    并且总在度假村的聚合之后调用，多个事务同时写入时加锁顺序一致，不会死锁。
+    只在当前事务里执行，由调用方 commit。
+
+    Args:
+        reviews: {user_id: [(recommendation, expenditure), ...]}
+        resorts: {user_id: 新建的度假村数}
+    """
+    reviews = reviews or {}
+    resorts = resorts or {}
+    for user_id in sorted(set(reviews) | set(resorts)):
+        values = {}
+        if resorts.get(user_id):
+            values['resort_count'] = User.resort_count + resorts[user_id]
+        items = reviews.get(user_id)
+        if items:
+            ratings = [recommendation for recommendation, _ in items if recommendation is not None]
+            expenses = [expenditure for _, expenditure in items if expenditure is not None]
+            values['review_count'] = User.review_count + len(items)
+            if ratings:
+                values['rating_count'] = User.rating_count + len(ratings)
+                values['rating_sum'] = User.rating_sum + sum(ratings)
+            if expenses:
+                values['expenditure_count'] = User.expenditure_count + len(expenses)
+                values['expenditure_sum'] = User.expenditure_sum + sum(expenses)
+        if values:
+            db.session.execute(
+                db.update(User).where(User.id == user_id).values(**values)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def compute_aggregates():
+    """
+    从 user_resort 全表重新计算所有度假村的聚合值
+
+    Returns:
+        {resort_id: {字段名: 值}}，没有任何评论的度假村也会返回清零后的值
+    """
+    rows = db.session.query(
+        UserResort.resort_id,
+        db.func.count(UserResort.id),
+        db.func.count(UserResort.recommendation),
+        db.func.sum(UserResort.recommendation),
+        db.func.count(UserResort.expenditure),
+        db.func.sum(UserResort.expenditure),
+        db.func.min(UserResort.expenditure),
+        db.func.max(UserResort.expenditure),
+    ).group_by(UserResort.resort_id).all()
+    by_resort = {}
+    for resort_id, reviews, ratings, rating_sum, expenses, expense_sum, expense_min, expense_max in rows:
+        rating_sum = int(rating_sum or 0)
+        by_resort[resort_id] = {
+            'review_count': reviews,
+            'rating_count': ratings,
+            'rating_sum': rating_sum,
+            'avg_score': _average(rating_sum, ratings),
+            'expenditure_count': expenses,
+            'expenditure_sum': float(expense_sum or 0),
+            'expenditure_min': float(expense_min) if expense_min is not None else None,
+            'expenditure_max': float(expense_max) if expense_max is not None else None,
+        }
+    empty = {
+        'review_count': 0,
+        'rating_count': 0,
+        'rating_sum': 0,
+        'avg_score': None,
+        'expenditure_count': 0,
+        'expenditure_sum': 0.0,
+        'expenditure_min': None,
+        'expenditure_max': None,
+    }
+    for (resort_id,) in db.session.query(Resort.id):
+        by_resort.setdefault(resort_id, dict(empty))
+    return by_resort
+
+
+def compute_user_aggregates():
+    """
+    从 resort 和 user_resort 重新计算所有用户的贡献计数
+
+    Returns:
+        {user_id: {字段名: 值}}
+    """
+    by_user = {user_id: dict.fromkeys(USER_AGGREGATE_FIELDS, 0) for (user_id,) in db.session.query(User.id)}
+    for user_id, resorts in db.session.query(Resort.creator_id, db.func.count(Resort.id)).filter(
+        Resort.creator_id.isnot(None)
+    ).group_by(Resort.creator_id):
+        if user_id in by_user:
+            by_user[user_id]['resort_count'] = resorts
+    rows = db.session.query(
+        UserResort.user_id,
+        db.func.count(UserResort.id),
+        db.func.count(UserResort.recommendation),
+        db.func.sum(UserResort.recommendation),
+        db.func.count(UserResort.expenditure),
+        db.func.sum(UserResort.expenditure),
+    ).group_by(UserResort.user_id)
+    for user_id, reviews, ratings, rating_sum, expenses, expense_sum in rows:
+        if user_id in by_user:
+            by_user[user_id].update({
+                'review_count': reviews,
+                'rating_count': ratings,
+                'rating_sum': int(rating_sum or 0),
+                'expenditure_count': expenses,
+                'expenditure_sum': float(expense_sum or 0),
+            })
+    return by_user
+
+
+def _same(stored, actual):
+    if stored is None or actual is None:
+        return stored is None and actual is None
+    return abs(float(stored) - float(actual)) < 1e-6
+
+
+def find_drift(expected=None, model=Resort):
+    """
+    对比 Resort（或 User）上保存的聚合值与重新计算的结果
+
+    Returns:
+        [(id, 字段名, 当前值, 正确值), ...]
+    """
+    fields = AGGREGATE_FIELDS if model is Resort else USER_AGGREGATE_FIELDS
+    if expected is None:
+        expected = compute_aggregates() if model is Resort else compute_user_aggregates()
+    columns = [getattr(model, field) for field in fields]
+    drift = []
+    for row in db.session.query(model.id, *columns):
+        actual = expected.get(row[0])
+        if actual is None:
+            continue
+        for field, stored in zip(fields, row[1:]):
+            if not _same(stored, actual[field]):
+                drift.append((row[0], field, stored, actual[field]))
+    return drift
+
+
+def rebuild_aggregates(expected=None, model=Resort):
+    """批量重写所有度假村（或用户）的聚合字段，返回更新的行数"""
+    if expected is None:
+        expected = compute_aggregates() if model is Resort else compute_user_aggregates()
+    mappings = [dict(values, id=row_id) for row_id, values in expected.items()]
+    if mappings:
+        db.session.bulk_update_mappings(model, mappings)
+    db.session.commit()
+    return len(mappings)
+
+
+@ratings_cli.command('verify')
+def verify_command():
+    """检查聚合字段是否与 user_resort 一致，有漂移时以非零状态退出"""
+    drift = find_drift()
+    user_drift = find_drift(model=User)
+    for resort_id, field, stored, actual in drift:
+        click.echo(f"resort {resort_id}: {field} = {stored}，应为 {actual}")
+    for user_id, field, stored, actual in user_drift:
+        click.echo(f"user {user_id}: {field} = {stored}，应为 {actual}")
+    if drift or user_drift:
+        resorts = len({item[0] for item in drift})
+        users = len({item[0] for item in user_drift})
+        click.echo(f"发现 {len(drift) + len(user_drift)} 处漂移，涉及 {resorts} 个度假村、{users} 个用户")
+        raise SystemExit(1)
+    click.echo("评分聚合与 user_resort 一致")
+
+
+@ratings_cli.command('rebuild')
+def rebuild_command():
+    """用 user_resort 全量重算聚合字段，并报告修复前的漂移"""
+    expected = compute_aggregates()
+    drift = find_drift(expected)
+    updated = rebuild_aggregates(expected)
+    resorts = len({item[0] for item in drift})
+    click.echo(f"已重建 {updated} 个度假村的评分聚合，修复前有 {resorts} 个存在漂移")
+    expected = compute_user_aggregates()
+    drift = find_drift(expected, User)
+    updated = rebuild_aggregates(expected, User)
+    users = len({item[0] for item in drift})
+    click.echo(f"已重建 {updated} 个用户的贡献计数，修复前有 {users} 个存在漂移")
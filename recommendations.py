@@ -0,0 +1,360 @@
+"""
+个性化推荐
+
+用 UserResort.recommendation 组成的 用户×度假村 评分矩阵离线训练矩阵分解模型：
+评分 ≈ 全站平均 + 用户偏置 + 度假村偏置 + 用户向量·度假村向量，向量用交替最小二乘（ALS）求解。
+评分矩阵以稀疏坐标（行下标、列下标、评分三个等长数组）保存，每一步把评分数相近的行分成一批，
+用 NumPy 的批量矩阵乘法和批量 k×k 线性方程求解，临时内存由 BLOCK_ELEMENTS 控制，与用户数无关。
+
+`flask --app app recommendations train` 由 cron 定期执行，训练后整体替换两张表：
+
+- user_recommendation：每个用户预测评分最高、且自己还没评过的 N 个度假村
+- similar_resort：每个度假村隐向量余弦相似度最高的 N 个度假村
+
+个人页和详情页只按主键读取这两张表，结果再放进进程内缓存，请求时不做任何模型计算。
+评分太少的度假村向量不可靠，不出现在推荐结果里（--min-ratings）。
+"""
+import threading
+import time
+from collections import namedtuple
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from cache import MemoryCache
+from setup_db import db, Resort, UserResort, UserRecommendation, SimilarResort
+
+recommendations_cli = AppGroup('recommendations', help='个性化推荐')
+
+# 分块计算时单个临时矩阵的元素数上限（8 字节浮点数，约 32MB）
+BLOCK_ELEMENTS = 1 << 22
+INSERT_BATCH = 5000
+
+# 页面展示用的度假村信息，缓存在进程内，不绑定数据库会话
+RecommendedResort = namedtuple('RecommendedResort', 'id resort_name country city resort_type avg_score score')
+
+
+class FactorModel:
+    """训练结果；user_ids / item_ids 升序，与各自的偏置和向量按行对齐"""
+
+    def __init__(self, user_ids, item_ids, rows, cols, mean, user_bias, item_bias, user_factors, item_factors):
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        # 训练集中已有评分的 (用户下标, 度假村下标)，按用户排序
+        self.rows = rows
+        self.cols = cols
+        self.mean = mean
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.item_counts = np.bincount(cols, minlength=len(item_ids))
+
+    def predict(self, users, items, factors=True):
+        """
+        按 id 预测评分；训练集中没有的用户或度假村只用平均分和另一侧的偏置
+
+        Args:
+            factors: 为 False 时只用平均分和偏置（评估时的基线）
+        """
+        u, u_known = _lookup(self.user_ids, users)
+        i, i_known = _lookup(self.item_ids, items)
+        scores = self.mean + np.where(u_known, self.user_bias[u], 0) + np.where(i_known, self.item_bias[i], 0)
+        if factors:
+            both = u_known & i_known
+            scores[both] += np.einsum('ij,ij->i', self.user_factors[u[both]], self.item_factors[i[both]])
+        return scores
+
+
+def _lookup(ids, values):
+    values = np.asarray(values)
+    if not len(ids):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+    return positions, ids[positions] == values
+
+
+def dedupe_ratings(users, items, ratings):
+    """
+    同一用户对同一度假村的多条评分取平均
+
+    Returns:
+        (user_ids, item_ids, 行下标, 列下标, 评分)，下标按 (行, 列) 排序
+    """
+    user_ids, rows = np.unique(users, return_inverse=True)
+    item_ids, cols = np.unique(items, return_inverse=True)
+    keys, inverse = np.unique(rows.astype(np.int64) * len(item_ids) + cols, return_inverse=True)
+    values = np.bincount(inverse, weights=ratings) / np.bincount(inverse)
+    return user_ids, item_ids, keys // len(item_ids), keys % len(item_ids), values
+
+
+def _biases(index, residual, size, reg):
+    """向 0 收缩的平均残差，评分越少收缩越多"""
+    return np.bincount(index, weights=residual, minlength=size) / (np.bincount(index, minlength=size) + reg)
+
+
+def _solve(rows, cols, residual, n_rows, other, reg):
+    """
+    固定另一侧的向量，逐行求解 (Yᵀ Y + reg·n·I) x = Yᵀ e
+
+    rows 必须升序。评分数相近的行（按 2 的幂分组）补齐到同样长度后堆成三维数组，
+    用批量矩阵乘法算出每行的 Yᵀ Y，再批量求解线性方程组；补齐的位置指向一个全零向量。
+    """
+    k = other.shape[1]
+    result = np.zeros((n_rows, k))
+    counts = np.bincount(rows, minlength=n_rows)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    padded = np.vstack([other, np.zeros(k)])
+    eye = np.eye(k)
+    lengths = 1 << np.ceil(np.log2(np.maximum(counts, 1))).astype(np.int64)
+    for length in np.unique(lengths):
+        members = np.flatnonzero(lengths == length)
+        # 补齐后的向量 (block×length×k) 和 Yᵀ Y (block×k×k) 都不超过 BLOCK_ELEMENTS
+        block = max(1, BLOCK_ELEMENTS // (max(length, k) * k))
+        for offset in range(0, len(members), block):
+            batch = members[offset:offset + block]
+            valid = np.arange(length) < counts[batch, None]
+            positions = np.where(valid, starts[batch, None] + np.arange(length), 0)
+            vectors = padded[np.where(valid, cols[positions], len(other))]
+            errors = np.where(valid, residual[positions], 0)
+            gram = np.matmul(vectors.transpose(0, 2, 1), vectors)
+            gram += reg * np.maximum(counts[batch], 1)[:, None, None] * eye
+            rhs = np.einsum('blk,bl->bk', vectors, errors)
+            result[batch] = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+    return result
+
+
+def train(users, items, ratings, factors=16, iterations=8, reg=0.25, bias_reg=5.0, seed=0):
+    """
+    训练矩阵分解模型
+
+    Args:
+        users, items, ratings: 等长数组，每条评分一项
+        reg: 隐向量的正则系数，按该行的评分数加权
+        bias_reg: 偏置的收缩强度，相当于多少条“平均评分”
+
+    Returns:
+        FactorModel
+    """
+    user_ids, item_ids, rows, cols, values = dedupe_ratings(users, items, ratings)
+    n_users, n_items = len(user_ids), len(item_ids)
+    mean = float(values.mean())
+    item_bias = _biases(cols, values - mean, n_items, bias_reg)
+    user_bias = _biases(rows, values - mean - item_bias[cols], n_users, bias_reg)
+    residual = values - mean - item_bias[cols] - user_bias[rows]
+
+    rng = np.random.default_rng(seed)
+    user_factors = np.zeros((n_users, factors))
+    item_factors = rng.normal(0, 0.1, (n_items, factors))
+    by_item = np.argsort(cols, kind='stable')
+    item_rows, item_cols, item_residual = cols[by_item], rows[by_item], residual[by_item]
+    for _ in range(iterations):
+        user_factors = _solve(rows, cols, residual, n_users, item_factors, reg)
+        item_factors = _solve(item_rows, item_cols, item_residual, n_items, user_factors, reg)
+    return FactorModel(user_ids, item_ids, rows, cols, mean, user_bias, item_bias, user_factors, item_factors)
+
+
+def _top(scores, n):
+    """每行分数最高的 n 列，按分数降序；-inf 表示不可选"""
+    n = min(n, scores.shape[1])
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def recommend_for_users(model, top_n, candidates):
+    """
+    每个用户预测评分最高、还没评过的度假村
+
+    Args:
+        candidates: 与 item_ids 对齐的布尔数组，只推荐为真的度假村
+
+    Yields:
+        (用户 id, 度假村 id 数组, 预测评分数组)
+    """
+    n_users = len(model.user_ids)
+    if not n_users or not candidates.any():
+        return
+    bounds = np.searchsorted(model.rows, np.arange(n_users + 1))
+    # 排序只需要单精度，分数矩阵的内存带宽减半
+    base = np.where(candidates, model.mean + model.item_bias, -np.inf).astype(np.float32)
+    user_factors = model.user_factors.astype(np.float32)
+    item_factors = model.item_factors.T.astype(np.float32)
+    user_bias = model.user_bias.astype(np.float32)
+    block = max(1, BLOCK_ELEMENTS // len(model.item_ids))
+    for start in range(0, n_users, block):
+        stop = min(start + block, n_users)
+        scores = user_factors[start:stop] @ item_factors + base + user_bias[start:stop, None]
+        rated = slice(bounds[start], bounds[stop])
+        scores[model.rows[rated] - start, model.cols[rated]] = -np.inf
+        top, top_scores = _top(scores, top_n)
+        for offset in range(stop - start):
+            keep = np.isfinite(top_scores[offset])
+            yield model.user_ids[start + offset], model.item_ids[top[offset][keep]], top_scores[offset][keep]
+
+
+def similar_items(model, top_n, candidates):
+    """
+    隐向量余弦相似度最高的度假村，只在 candidates 之间比较，只保留相似度为正的
+
+    Yields:
+        (度假村 id, 相似度假村 id 数组, 相似度数组)
+    """
+    index = np.flatnonzero(candidates)
+    if len(index) < 2:
+        return
+    vectors = model.item_factors[index]
+    norms = np.linalg.norm(vectors, axis=1)
+    vectors = vectors / np.where(norms > 0, norms, 1)[:, None]
+    block = max(1, BLOCK_ELEMENTS // len(index))
+    for start in range(0, len(index), block):
+        stop = min(start + block, len(index))
+        scores = vectors[start:stop] @ vectors.T
+        scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top, top_scores = _top(scores, top_n)
+        for offset in range(stop - start):
+            keep = top_scores[offset] > 0
+            yield model.item_ids[index[start + offset]], model.item_ids[index[top[offset][keep]]], top_scores[offset][keep]
+
+
+def load_ratings():
+    """
+    分批读取全部有评分的评论
+
+    Returns:
+        (用户 id, 度假村 id, 评分) 三个等长数组
+    """
+    result = db.session.execute(
+        db.select(UserResort.user_id, UserResort.resort_id, UserResort.recommendation)
+        .where(UserResort.recommendation.isnot(None))
+        .execution_options(yield_per=50000)
+    )
+    parts = [np.array(part, dtype=np.int64).reshape(-1, 3) for part in result.partitions()]
+    data = np.concatenate(parts) if parts else np.zeros((0, 3), dtype=np.int64)
+    return data[:, 0], data[:, 1], data[:, 2].astype(np.float64)
+
+
+def _replace(model, results, owner_key, target_key):
+    """清空表后分批写入 (owner, [target...], [score...])，返回写入的 owner 数"""
+    db.session.execute(db.delete(model))
+    owners = 0
+    batch = []
+    for owner, targets, scores in results:
+        owners += bool(len(targets))
+        batch.extend({owner_key: int(owner), 'rank': rank, target_key: int(target), 'score': round(float(score), 4)}
+                     for rank, (target, score) in enumerate(zip(targets, scores), 1))
+        if len(batch) >= INSERT_BATCH:
+            db.session.execute(db.insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+    return owners
+
+
+class Recommender:
+    """按主键读取训练好的推荐结果，并缓存在进程内"""
+
+    def __init__(self, app=None):
+        self.cache = MemoryCache()
+        self.response_cache = None
+        self.limit = 6
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        RECOMMENDATION_LIMIT: 页面上展示的条数，默认 6
+        RECOMMENDATION_CACHE_TTL: 缓存秒数，默认 300；训练任务通过 'recommendations' 标签让缓存立即失效
+        RECOMMENDATION_CACHE_MAX_ENTRIES: 最多缓存的用户和度假村数，默认 10000
+        """
+        self.limit = int(app.config.get('RECOMMENDATION_LIMIT', 6))
+        self.cache = MemoryCache(
+            max_entries=int(app.config.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000)),
+            default_ttl=int(app.config.get('RECOMMENDATION_CACHE_TTL', 300))
+        )
+        app.extensions['recommender'] = self
+        # 训练任务在 CLI 进程中运行，由 ResponseCache 读取 cache_tag 表后转告本进程
+        self.response_cache = app.extensions.get('response_cache')
+        if self.response_cache is not None:
+            self.response_cache.on_invalidate(self._on_invalidate)
+
+    def _on_invalidate(self, tag):
+        if tag == 'recommendations':
+            self.cache.clear()
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get(self, key, query):
+        if self.response_cache is not None:
+            self.response_cache.sync_shared_tags()
+        items = self.cache.get(key)
+        if items is not None:
+            self._count('hits')
+            return items
+        self._count('misses')
+        items = [RecommendedResort(*row) for row in query.limit(self.limit)]
+        self.cache.set(key, items)
+        return items
+
+    def for_user(self, user_id):
+        """为用户推荐的度假村（RecommendedResort 列表，score 为预测评分）"""
+        return self._get(f'user:{user_id}', db.session.query(
+            Resort.id, Resort.resort_name, Resort.country, Resort.city, Resort.resort_type, Resort.avg_score,
+            UserRecommendation.score
+        ).join(UserRecommendation, UserRecommendation.resort_id == Resort.id).filter(
+            UserRecommendation.user_id == user_id
+        ).order_by(UserRecommendation.rank))
+
+    def similar_to(self, resort_id):
+        """与度假村相似的度假村（RecommendedResort 列表，score 为相似度）"""
+        return self._get(f'resort:{resort_id}', db.session.query(
+            Resort.id, Resort.resort_name, Resort.country, Resort.city, Resort.resort_type, Resort.avg_score,
+            SimilarResort.score
+        ).join(SimilarResort, SimilarResort.similar_id == Resort.id).filter(
+            SimilarResort.resort_id == resort_id
+        ).order_by(SimilarResort.rank))
+
+    def stats(self):
+        return [
+            ('travelhub_recommendation_cache_hits_total', 'Recommendation lookups served from cache.', 'counter', self.hits),
+            ('travelhub_recommendation_cache_misses_total', 'Recommendation lookups that queried the database.', 'counter', self.misses),
+        ]
+
+
+@recommendations_cli.command('train')
+@click.option('--factors', default=16, show_default=True, help='隐向量维数')
+@click.option('--iterations', type=click.IntRange(min=1), default=8, show_default=True, help='ALS 迭代次数')
+@click.option('--regularization', default=0.25, show_default=True, help='隐向量的正则系数')
+@click.option('--top', 'top_n', default=20, show_default=True, help='每个用户 / 度假村保存的条数')
+@click.option('--min-ratings', default=3, show_default=True, help='评分少于这个数的度假村不参与推荐')
+def train_command(factors, iterations, regularization, top_n, min_ratings):
+    """训练推荐模型并替换 user_recommendation / similar_resort（建议由 cron 每天执行）"""
+    start = time.perf_counter()
+    users, items, ratings = load_ratings()
+    loaded = time.perf_counter()
+    if not len(ratings):
+        db.session.execute(db.delete(UserRecommendation))
+        db.session.execute(db.delete(SimilarResort))
+        db.session.commit()
+        click.echo("还没有评分，已清空推荐结果")
+        return
+    model = train(users, items, ratings, factors, iterations, regularization)
+    trained = time.perf_counter()
+    candidates = model.item_counts >= min_ratings
+    user_count = _replace(UserRecommendation, recommend_for_users(model, top_n, candidates), 'user_id', 'resort_id')
+    resort_count = _replace(SimilarResort, similar_items(model, top_n, candidates), 'resort_id', 'similar_id')
+    db.session.commit()
+    response_cache = current_app.extensions.get('response_cache')
+    if response_cache is not None:
+        # CLI 与 web worker 不在同一个进程，通过 cache_tag 表通知它们
+        response_cache.invalidate('recommendations', shared=True)
+    click.echo(f"{len(ratings)} 条评分，{len(model.user_ids)} 个用户，{len(model.item_ids)} 个度假村"
+               f"（{int(candidates.sum())} 个参与推荐）")
+    click.echo(f"读取 {loaded - start:.2f}s，训练 {trained - loaded:.2f}s，写入 {time.perf_counter() - trained:.2f}s；"
+               f"为 {user_count} 个用户生成推荐，为 {resort_count} 个度假村找到相似度假村")
@@ -0,0 +1,112 @@
+"""
+读写分离
+
+配置 SQLALCHEMY_REPLICA_URIS 后，每个副本注册为一个名为 replica_<n> 的 bind。
+GET/HEAD 请求中的查询发往副本（同一个请求固定使用其中一个，分页等多次查询看到的是同一份数据），
+写入、flush、SELECT ... FOR UPDATE，以及请求之外（命令行、后台线程）的查询都走主库。
+
+用户写入之后 REPLICA_STICKY_SECONDS 秒内，他的请求都读主库（时间记录在 session cookie 中，
+所有 worker 都能看到），不会因为复制延迟看不到自己刚提交的内容。
+缓存的响应是所有用户共享的，粘滞期内的请求不使用响应缓存（见 cache.py），
+失效后 REPLICA_STICKY_SECONDS 秒内从副本读出的响应也不写入缓存。
+"""
+import random
+import time
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_PREFIX = 'replica_'
+_STICKY_KEY = '_db_primary_until'
+
+
+def replica_binds(uris):
+    """副本 URI 列表 -> {bind 名: URI}"""
+    return {f'{REPLICA_PREFIX}{i}': uri for i, uri in enumerate(uris)}
+
+
+def use_primary():
+    """当前请求余下的查询都读主库"""
+    if has_request_context():
+        g.db_read_replica = False
+
+
+def mark_write():
+    """记录当前用户刚刚写入，请求结束时开始读主库的粘滞期"""
+    if has_request_context():
+        g.db_wrote = True
+        g.db_read_replica = False
+
+
+def reading_own_writes():
+    """当前用户处于写入后的粘滞期，本次请求读主库"""
+    return has_request_context() and g.get('db_sticky', False)
+
+
+def replica_was_read():
+    """本次请求中是否有查询发往了副本（结果可能落后于主库）"""
+    return has_request_context() and g.get('db_replica_used', False)
+
+
+class RoutingSession(Session):
+    """只读请求中的查询发往副本，其余情况交给 Flask-SQLAlchemy 按模型的 bind 选择主库"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = self._replica_engine(clause)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self, clause):
+        if not has_request_context() or not g.get('db_read_replica'):
+            return None
+        if self._flushing or self.new or self.dirty or self.deleted:
+            return None
+        if clause is not None and (getattr(clause, 'is_dml', False)
+                                   or getattr(clause, '_for_update_arg', None) is not None):
+            return None
+        engines = self._db.engines
+        key = self.info.get('replica')
+        if key is None:
+            keys = [key for key in engines if key and key.startswith(REPLICA_PREFIX)]
+            if not keys:
+                return None
+            key = self.info['replica'] = random.choice(keys)
+        g.db_replica_used = True
+        return engines[key]
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    mark_write()
+
+
+class ReplicaRouting:
+    """按请求决定是否读副本，并维护写入后的主库粘滞期"""
+
+    def __init__(self, app=None):
+        self.sticky_seconds = 5.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        SQLALCHEMY_REPLICA_URIS: 只读副本的 URI 列表，为空时所有查询都走主库（由 setup_db.init_app 注册为 bind）
+        REPLICA_STICKY_SECONDS: 用户写入后多少秒内读主库，应大于复制延迟，默认 5
+        """
+        self.sticky_seconds = float(app.config.get('REPLICA_STICKY_SECONDS', 5))
+        self.enabled = bool(app.config.get('SQLALCHEMY_REPLICA_URIS'))
+        app.extensions['replica_routing'] = self
+        if self.enabled:
+            app.before_request(self._before_request)
+            app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.db_sticky = session.get(_STICKY_KEY, 0) > time.time()
+        g.db_read_replica = request.method in ('GET', 'HEAD') and not g.db_sticky
+
+    def _after_request(self, response):
+        if g.get('db_wrote') and self.sticky_seconds > 0:
+            session[_STICKY_KEY] = time.time() + self.sticky_seconds
+        return response
@@ -0,0 +1,377 @@
+"""
+地区与度假村类型的统计汇总
+
+user_resort 上的评分和花费从没有被分析过，临时报表只能对业务表做全表 GROUP BY。
+`flask --app app stats refresh` 由 cron 定期执行，把评论汇总进 stats_rollup 表：
+
+- geo：全站 → 国家 → 州/省 → 城市
+- type：按 resort_type
+
+每行保存度假村数、评论数、评分数与平均分，以及花费的数量、总和、最小/最大值和 p50/p90/p99。
+百分位数由对数分桶的直方图得到（每翻一倍分 8 个桶，取桶的几何中点，相对误差约 4%）。
+直方图可以直接相加，所以每次只读取上次之后的新评论，加到城市和类型这两类叶子行上，
+上层各行由叶子合并得到。/api/stats/... 按主键读取一行及其下一级，耗时与评论数量无关。
+
+地区和类型是自由填写的文本，分组键用 group_key()（忽略大小写、重音和首尾空格，与 MySQL 的
+utf8mb4_unicode_ci 排序规则一致），"China " 和 "china" 属于同一组；label 保存最常见的写法用于展示。
+"""
+import json
+import math
+import time
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_
+from setup_db import db, eastern, group_key, Resort, UserResort, StatsRollup, StatsState
+from ratings import _average
+
+stats_cli = AppGroup('stats', help='地区与类型统计汇总')
+
+GEO_LEVELS = ('country', 'state', 'city')
+# 新评论直接累加到的叶子层级，上层由叶子合并
+LEAF_DEPTH = {'geo': len(GEO_LEVELS), 'type': 1}
+BUCKETS_PER_DOUBLING = 8
+PERCENTILES = (50, 90, 99)
+READ_BATCH = 10000
+GEO_COLUMNS = (Resort.country, Resort.state, Resort.city)
+
+
+def rollup_key(path):
+    """'[]'、'["japan"]'、'["japan", "hokkaido", "sapporo"]'，没有填写的层级为空字符串"""
+    return json.dumps(list(path), ensure_ascii=False)
+
+
+def bucket(value):
+    """花费所在的桶：[2^((i-1)/8), 2^(i/8)) 为第 i 个桶，小于 1 的都在 0 号桶"""
+    if value < 1:
+        return 0
+    return 1 + int(math.log2(value) * BUCKETS_PER_DOUBLING)
+
+
+def bucket_value(index):
+    return 0.0 if index == 0 else 2 ** ((index - 0.5) / BUCKETS_PER_DOUBLING)
+
+
+class Aggregate:
+    """一组评论的可合并汇总值"""
+
+    def __init__(self):
+        self.resort_count = 0
+        self.review_count = 0
+        self.rating_count = 0
+        self.rating_sum = 0
+        self.expenditure_count = 0
+        self.expenditure_sum = 0.0
+        self.expenditure_min = None
+        self.expenditure_max = None
+        self.histogram = {}
+
+    @classmethod
+    def from_row(cls, row):
+        aggregate = cls()
+        for name in ('resort_count', 'review_count', 'rating_count', 'rating_sum', 'expenditure_count',
+                     'expenditure_sum', 'expenditure_min', 'expenditure_max'):
+            setattr(aggregate, name, getattr(row, name))
+        aggregate.histogram = {int(index): count for index, count in (row.histogram or {}).items()}
+        return aggregate
+
+    def add(self, recommendation, expenditure):
+        self.review_count += 1
+        if recommendation is not None:
+            self.rating_count += 1
+            self.rating_sum += recommendation
+        if expenditure is not None:
+            self.expenditure_count += 1
+            self.expenditure_sum += expenditure
+            if self.expenditure_min is None or expenditure < self.expenditure_min:
+                self.expenditure_min = expenditure
+            if self.expenditure_max is None or expenditure > self.expenditure_max:
+                self.expenditure_max = expenditure
+            index = bucket(expenditure)
+            self.histogram[index] = self.histogram.get(index, 0) + 1
+
+    def merge(self, other):
+        self.resort_count += other.resort_count
+        self.review_count += other.review_count
+        self.rating_count += other.rating_count
+        self.rating_sum += other.rating_sum
+        self.expenditure_count += other.expenditure_count
+        self.expenditure_sum += other.expenditure_sum
+        if other.expenditure_min is not None and (self.expenditure_min is None or other.expenditure_min < self.expenditure_min):
+            self.expenditure_min = other.expenditure_min
+        if other.expenditure_max is not None and (self.expenditure_max is None or other.expenditure_max > self.expenditure_max):
+            self.expenditure_max = other.expenditure_max
+        for index, count in other.histogram.items():
+            self.histogram[index] = self.histogram.get(index, 0) + count
+
+    def percentile(self, pct):
+        """最近秩法，结果限制在实际的最小/最大值之间"""
+        if not self.expenditure_count:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.expenditure_count))
+        seen = 0
+        for index in sorted(self.histogram):
+            seen += self.histogram[index]
+            if seen >= rank:
+                return round(min(max(bucket_value(index), self.expenditure_min), self.expenditure_max), 2)
+        return self.expenditure_max
+
+    def values(self):
+        """写入 StatsRollup 的列"""
+        values = {
+            'resort_count': self.resort_count,
+            'review_count': self.review_count,
+            'rating_count': self.rating_count,
+            'rating_sum': self.rating_sum,
+            'avg_score': _average(self.rating_sum, self.rating_count),
+            'expenditure_count': self.expenditure_count,
+            'expenditure_sum': self.expenditure_sum,
+            'expenditure_min': self.expenditure_min,
+            'expenditure_max': self.expenditure_max,
+            # JSON 的键只能是字符串
+            'histogram': {str(index): self.histogram[index] for index in sorted(self.histogram)},
+        }
+        for pct in PERCENTILES:
+            values[f'expenditure_p{pct}'] = self.percentile(pct)
+        return values
+
+
+def _now():
+    # 与 created_at 的默认值一致：美东时间，不带时区
+    return datetime.now(eastern).replace(tzinfo=None)
+
+
+def _matches(column, value):
+    """叶子路径中的空字符串对应 NULL 或空字符串"""
+    return column == value if value else or_(column.is_(None), column == '')
+
+
+def _review_rows(*conditions):
+    return db.session.execute(db.select(
+        Resort.country, Resort.state, Resort.city, Resort.resort_type,
+        UserResort.recommendation, UserResort.expenditure
+    ).join(Resort, Resort.id == UserResort.resort_id).where(*conditions).execution_options(yield_per=READ_BATCH))
+
+
+def _raw_paths(country, state, city, resort_type):
+    return (('geo', (country or '', state or '', city or '')), ('type', (resort_type or '',)))
+
+
+def _leaf_paths(country, state, city, resort_type):
+    return tuple((dimension, tuple(group_key(value) for value in path))
+                 for dimension, path in _raw_paths(country, state, city, resort_type))
+
+
+def _resort_totals():
+    """
+    按叶子统计度假村数和 Resort.review_count 之和（只扫描 resort 表，与评论数量无关）
+
+    Returns:
+        ({(dimension, 叶子路径): (度假村数, 评论数)}, {(dimension, 叶子路径): {原始写法: 度假村数}})
+    """
+    totals, spellings = {}, {}
+    rows = db.session.execute(db.select(
+        Resort.country, Resort.state, Resort.city, Resort.resort_type,
+        db.func.count(Resort.id), db.func.sum(Resort.review_count)
+    ).group_by(Resort.country, Resort.state, Resort.city, Resort.resort_type))
+    for country, state, city, resort_type, resorts, reviews in rows:
+        raw_paths = _raw_paths(country, state, city, resort_type)
+        for leaf, (_, raw) in zip(_leaf_paths(country, state, city, resort_type), raw_paths):
+            count, total = totals.get(leaf, (0, 0))
+            totals[leaf] = (count + resorts, total + int(reviews or 0))
+            variants = spellings.setdefault(leaf, {})
+            variants[raw] = variants.get(raw, 0) + resorts
+    return totals, spellings
+
+
+def _recount(dimension, path, variants, watermark):
+    """按水位线以内的全部评论重算一个叶子；variants 为这个叶子在 resort 表中的各种原始写法"""
+    aggregate = Aggregate()
+    columns = GEO_COLUMNS if dimension == 'geo' else (Resort.resort_type,)
+    condition = or_(*(and_(*(_matches(column, value) for column, value in zip(columns, raw))) for raw in variants))
+    for country, state, city, resort_type, recommendation, expenditure in _review_rows(UserResort.id <= watermark, condition):
+        # SQLite 的比较区分大小写，MySQL 的排序规则又可能比 group_key 宽，按 group_key 再筛一遍
+        if (dimension, path) in _leaf_paths(country, state, city, resort_type):
+            aggregate.add(recommendation, expenditure)
+    return aggregate
+
+
+def _labels(spellings):
+    """每个叶子取度假村最多的写法（去掉首尾空格）作为展示用的路径"""
+    labels = {}
+    for leaf, variants in spellings.items():
+        raw = min(variants, key=lambda value: (-variants[value], value))
+        labels[leaf] = tuple(value.strip() for value in raw)
+    return labels
+
+
+def _rollup(leaves, labels):
+    """
+    由叶子合并出全部行
+
+    Returns:
+        {(dimension, 路径): (上一级路径或 None, 展示路径, Aggregate)}
+    """
+    rows = {(dimension, ()): (None, (), Aggregate()) for dimension in LEAF_DEPTH}
+    # 上层的展示路径取度假村最多的那个叶子的写法
+    for (dimension, path), leaf in sorted(leaves.items(), key=lambda item: -item[1].resort_count):
+        label = labels.get((dimension, path), path)
+        for depth in range(len(path) + 1):
+            prefix = path[:depth]
+            if (dimension, prefix) not in rows:
+                rows[(dimension, prefix)] = (path[:depth - 1], label[:depth], Aggregate())
+            rows[(dimension, prefix)][2].merge(leaf)
+    return rows
+
+
+def _changed(old, new):
+    for name, value in new.items():
+        stored = old.get(name)
+        if isinstance(value, float) and stored is not None:
+            if not math.isclose(value, stored, rel_tol=1e-6, abs_tol=1e-6):
+                return True
+        elif value != stored:
+            return True
+    return False
+
+
+def refresh(full=False):
+    """
+    把新评论汇总进 stats_rollup
+
+    事务提交顺序与自增 id 不一致时，个别评论会落在水位线以下而被跳过；度假村修改了地区或类型时，
+    旧叶子里还留着它的评论。叶子的评论数与其中度假村的 review_count 之和不一致时，
+    按水位线以内的全部评论重算这个叶子；已经没有度假村的叶子及其上层行会被删除。
+
+    Returns:
+        {'mode': 'full' 或 'incremental', 'reviews': 读取的新评论数, 'repaired': 重算或删除的叶子数, 'rows': 写入或删除的行数}
+    """
+    now = _now()
+    state = db.session.get(StatsState, 1)
+    if state is None:
+        full = True
+    # 先定水位线，再读 Resort 上的计数：计数只会比水位线新，不会漏掉评论
+    watermark = db.session.execute(db.select(db.func.max(UserResort.id))).scalar() or 0
+    existing = {
+        (row.dimension, row.key): row
+        for row in db.session.execute(db.select(StatsRollup)).scalars()
+    }
+    leaves = {}
+    if full:
+        conditions = [UserResort.id <= watermark]
+    else:
+        conditions = [UserResort.id > state.last_review_id, UserResort.id <= watermark]
+        for (dimension, key), row in existing.items():
+            path = tuple(json.loads(key))
+            if len(path) == LEAF_DEPTH[dimension]:
+                leaves[(dimension, path)] = Aggregate.from_row(row)
+
+    new_reviews = 0
+    for country, state_name, city, resort_type, recommendation, expenditure in _review_rows(*conditions):
+        for leaf in _leaf_paths(country, state_name, city, resort_type):
+            if leaf not in leaves:
+                leaves[leaf] = Aggregate()
+            leaves[leaf].add(recommendation, expenditure)
+        new_reviews += 1
+
+    totals, spellings = _resort_totals()
+    repaired = 0
+    for leaf in set(leaves) - set(totals):
+        del leaves[leaf]
+        repaired += 1
+    for leaf, (resorts, reviews) in totals.items():
+        aggregate = leaves.get(leaf) or Aggregate()
+        if not full and reviews != aggregate.review_count:
+            recounted = _recount(*leaf, spellings[leaf], watermark)
+            if recounted.review_count != aggregate.review_count:
+                aggregate = recounted
+                repaired += 1
+        aggregate.resort_count = resorts
+        leaves[leaf] = aggregate
+
+    if full:
+        db.session.execute(db.delete(StatsRollup))
+        existing = {}
+    inserts, updates = [], []
+    rows = {(dimension, rollup_key(path)): item
+            for (dimension, path), item in _rollup(leaves, _labels(spellings)).items()}
+    stale = [row for rollup_id, row in existing.items() if rollup_id not in rows]
+    for row in stale:
+        db.session.delete(row)
+    for (dimension, key), (parent, label, aggregate) in rows.items():
+        values = dict(aggregate.values(), label=rollup_key(label))
+        row = existing.get((dimension, key))
+        if row is None:
+            inserts.append(dict(values, dimension=dimension, key=key,
+                                parent=None if parent is None else rollup_key(parent)))
+        elif _changed({name: getattr(row, name) for name in values}, values):
+            updates.append(dict(values, dimension=dimension, key=key))
+    if updates:
+        db.session.bulk_update_mappings(StatsRollup, updates)
+    if inserts:
+        db.session.execute(db.insert(StatsRollup), inserts)
+
+    if state is None:
+        state = StatsState(id=1)
+        db.session.add(state)
+    state.last_review_id = watermark
+    state.refreshed_at = now
+    db.session.commit()
+    return {'mode': 'full' if full else 'incremental', 'reviews': new_reviews, 'repaired': repaired,
+            'rows': len(inserts) + len(updates) + len(stale)}
+
+
+def rollup_summary(row):
+    """StatsRollup 在 JSON 接口中的表示"""
+    path = [value or None for value in json.loads(row.label or row.key)]
+    summary = dict(zip(GEO_LEVELS, path)) if row.dimension == 'geo' else {'resort_type': path[0] if path else None}
+    summary.update({
+        'resort_count': row.resort_count,
+        'review_count': row.review_count,
+        'rating_count': row.rating_count,
+        'avg_score': row.avg_score,
+        'expenditure': {
+            'count': row.expenditure_count,
+            'average': _average(row.expenditure_sum, row.expenditure_count),
+            'min': row.expenditure_min,
+            'p50': row.expenditure_p50,
+            'p90': row.expenditure_p90,
+            'p99': row.expenditure_p99,
+            'max': row.expenditure_max,
+        },
+    })
+    return summary
+
+
+def group_stats(dimension, path, limit=100):
+    """
+    一个分组及其下一级分组（按评论数从多到少）
+
+    Returns:
+        (分组, [下一级分组, ...], 最近一次汇总的时间)，分组不存在时返回 None
+    """
+    key = rollup_key(group_key(value) for value in path)
+    row = db.session.get(StatsRollup, (dimension, key))
+    if row is None:
+        return None
+    children = db.session.execute(
+        db.select(StatsRollup).where(StatsRollup.dimension == dimension, StatsRollup.parent == key)
+        .order_by(StatsRollup.review_count.desc(), StatsRollup.key).limit(limit)
+    ).scalars().all()
+    state = db.session.get(StatsState, 1)
+    return row, children, state.refreshed_at if state else None
+
+
+@stats_cli.command('refresh')
+@click.option('--full', is_flag=True, help='忽略已有的汇总，从全部评论重新计算')
+def refresh_command(full):
+    """增量更新地区和类型的统计汇总（建议由 cron 每几分钟执行）"""
+    start = time.perf_counter()
+    result = refresh(full)
+    response_cache = current_app.extensions.get('response_cache')
+    if response_cache is not None and result['rows']:
+        # CLI 与 web worker 不在同一个进程，通过 cache_tag 表通知它们
+        response_cache.invalidate('stats', shared=True)
+    click.echo(f"{result['mode']}：读取 {result['reviews']} 条新评论，重算 {result['repaired']} 个分组，"
+               f"写入或删除 {result['rows']} 行，耗时 {time.perf_counter() - start:.2f}s")
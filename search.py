@@ -0,0 +1,245 @@
+"""
+度假村搜索与分面过滤
+
+按名称/城市全文匹配，并按 country、state、city、resort_type 过滤，同时返回各分面的计数。
+结果按首页排行顺序（avg_score DESC, id DESC）排列。
+
+- MySQL：名称和城市上的 FULLTEXT 索引（ngram 分词，支持中文）加上分面列的组合索引
+- 其他数据库（SQLite 开发/基准环境）：进程内倒排索引
+
+倒排索引中的文档按排行顺序编号，词项对应 NumPy 位置数组，分面取值编码成整数数组，
+过滤与求交集都是布尔数组运算，分面计数用 bincount，
+10 万个度假村时一次查询也在几毫秒以内。
+"""
+import bisect
+import re
+import threading
+import time
+import numpy as np
+from sqlalchemy import text
+from setup_db import db, Resort
+from cache import skip_cache
+
+FACETS = ('country', 'state', 'city', 'resort_type')
+# 每个分面最多返回的取值个数
+FACET_LIMIT = 20
+
+_WORD = re.compile(r'[0-9a-z]+')
+_CJK = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+')
+
+
+def tokenize(value):
+    """英文数字按单词切分，中文按单字和相邻两字切分"""
+    if not value:
+        return []
+    value = value.lower()
+    tokens = _WORD.findall(value)
+    for run in _CJK.findall(value):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_terms(q):
+    """
+    把搜索词拆成需要同时满足的词项
+
+    Returns:
+        [(词项, 是否允许前缀匹配), ...]
+    """
+    if not q:
+        return []
+    q = q.lower()
+    terms = [(word, True) for word in _WORD.findall(q)]
+    for run in _CJK.findall(q):
+        if len(run) == 1:
+            terms.append((run, False))
+        else:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+    return terms
+
+
+class InvertedIndex:
+    """进程内倒排索引，SQLite 等不支持 FULLTEXT 的数据库使用"""
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.postings = {}
+        self.vocabulary = []
+        self.codes = {facet: np.zeros(0, dtype=np.int32) for facet in FACETS}
+        self.values = {facet: [] for facet in FACETS}
+        self.value_codes = {facet: {} for facet in FACETS}
+
+    def build(self, rows):
+        """rows 需按排行顺序排列：(id, resort_name, country, state, city, resort_type)"""
+        postings = {}
+        codes = {facet: [] for facet in FACETS}
+        value_codes = {facet: {} for facet in FACETS}
+        ids = []
+        for position, (resort_id, name, country, state, city, resort_type) in enumerate(rows):
+            ids.append(resort_id)
+            for token in set(tokenize(name) + tokenize(city)):
+                postings.setdefault(token, []).append(position)
+            for facet, value in zip(FACETS, (country, state, city, resort_type)):
+                if value:
+                    codes[facet].append(value_codes[facet].setdefault(value, len(value_codes[facet])))
+                else:
+                    codes[facet].append(-1)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.postings = {token: np.array(positions, dtype=np.int32) for token, positions in postings.items()}
+        self.vocabulary = sorted(postings)
+        self.codes = {facet: np.array(codes[facet], dtype=np.int32) for facet in FACETS}
+        self.value_codes = value_codes
+        self.values = {facet: list(value_codes[facet]) for facet in FACETS}
+
+    def _term_positions(self, term, prefix):
+        if not prefix:
+            return self.postings.get(term)
+        # 词表有序，以 term 开头的词项是连续的一段；全部展开，否则总数和分面计数会偏小
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_right(self.vocabulary, term + '\uffff', start)
+        matched = [self.postings[token] for token in self.vocabulary[start:end]]
+        if not matched:
+            return None
+        return matched[0] if len(matched) == 1 else np.concatenate(matched)
+
+    def search(self, q, filters, offset, limit):
+        size = len(self.ids)
+        text_mask = np.ones(size, dtype=bool)
+        for term, prefix in query_terms(q):
+            positions = self._term_positions(term, prefix)
+            term_mask = np.zeros(size, dtype=bool)
+            if positions is not None:
+                term_mask[positions] = True
+            text_mask &= term_mask
+        filter_masks = {}
+        for facet, value in filters.items():
+            code = self.value_codes[facet].get(value)
+            filter_masks[facet] = self.codes[facet] == code if code is not None else np.zeros(size, dtype=bool)
+        result = text_mask.copy()
+        for mask in filter_masks.values():
+            result &= mask
+
+        facet_counts = {}
+        for facet in FACETS:
+            # 分面计数不受自身过滤条件影响，方便在同一分面内切换取值
+            base = text_mask
+            for other, mask in filter_masks.items():
+                if other != facet:
+                    base = base & mask
+            codes = self.codes[facet][base]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.values[facet]))
+            top = np.flatnonzero(counts)
+            if len(top) > FACET_LIMIT:
+                top = top[np.argpartition(-counts[top], FACET_LIMIT)[:FACET_LIMIT]]
+            values = [(self.values[facet][code], int(counts[code])) for code in top]
+            values.sort(key=lambda item: (-item[1], item[0]))
+            facet_counts[facet] = values
+
+        # 位置就是排行顺序，按位置取即可得到排好序的结果
+        positions = np.flatnonzero(result)
+        ids = self.ids[positions[offset:offset + limit]].tolist()
+        return ids, len(positions), facet_counts
+
+
+class SearchIndex:
+    """根据数据库类型选择 FULLTEXT 查询或进程内倒排索引"""
+
+    def __init__(self, app=None):
+        self.index = None
+        self.built_at = 0.0
+        self.dirty = True
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        SEARCH_INDEX_TTL: 倒排索引最长多少秒后重建（捕获其他 worker 的写入），默认 300
+        SEARCH_INDEX_MIN_INTERVAL: 有写入后两次重建之间的最短间隔秒数，默认 5
+        """
+        self.ttl = float(app.config.get('SEARCH_INDEX_TTL', 300))
+        self.min_interval = float(app.config.get('SEARCH_INDEX_MIN_INTERVAL', 5))
+        app.extensions['search_index'] = self
+
+    def invalidate(self):
+        """度假村或评分变化后调用，倒排索引会在下次查询时按需重建"""
+        self.dirty = True
+
+    def _inverted_index(self):
+        age = time.monotonic() - self.built_at
+        if self.index is None or age > self.ttl or (self.dirty and age > self.min_interval):
+            with self._lock:
+                age = time.monotonic() - self.built_at
+                if self.index is None or age > self.ttl or (self.dirty and age > self.min_interval):
+                    # 先清除标记再读取：读取期间的写入会重新标记，下次再重建
+                    self.dirty = False
+                    try:
+                        rows = db.session.query(
+                            Resort.id, Resort.resort_name, Resort.country, Resort.state, Resort.city, Resort.resort_type
+                        ).order_by(Resort.avg_score.desc(), Resort.id.desc()).all()
+                    except Exception:
+                        self.dirty = True
+                        raise
+                    index = InvertedIndex()
+                    index.build(rows)
+                    self.index = index
+                    self.built_at = time.monotonic()
+        return self.index
+
+    def search(self, q, filters, offset=0, limit=20):
+        """
+        Args:
+            q: 搜索词，匹配名称和城市
+            filters: {分面: 取值}，只接受 FACETS 中的分面
+
+        Returns:
+            (当前页 Resort 列表, 总数, {分面: [(取值, 数量), ...]})
+        """
+        filters = {facet: value for facet, value in filters.items() if facet in FACETS and value}
+        if db.engine.dialect.name == 'mysql':
+            return _mysql_search(q, filters, offset, limit)
+        ids, total, facets = self._inverted_index().search(q, filters, offset, limit)
+        if self.dirty:
+            # 写入后 min_interval 秒内仍用旧索引，结果不能按新的标签版本缓存下来
+            skip_cache()
+        if not ids:
+            return [], total, facets
+        by_id = {resort.id: resort for resort in Resort.query.filter(Resort.id.in_(ids))}
+        return [by_id[i] for i in ids if i in by_id], total, facets
+
+
+def _boolean_query(q):
+    """把搜索词转换成 MySQL BOOLEAN MODE 语法，每个词都必须出现"""
+    parts = []
+    for term, prefix in query_terms(q):
+        parts.append(f'+{term}*' if prefix else f'+"{term}"')
+    return ' '.join(parts)
+
+
+def _mysql_search(q, filters, offset, limit):
+    match = None
+    boolean_query = _boolean_query(q)
+    if boolean_query:
+        match = text('MATCH (resort.resort_name, resort.city) AGAINST (:q IN BOOLEAN MODE)').bindparams(q=boolean_query)
+
+    def filtered(query, exclude=None):
+        if match is not None:
+            query = query.filter(match)
+        for facet, value in filters.items():
+            if facet != exclude:
+                query = query.filter(getattr(Resort, facet) == value)
+        return query
+
+    query = filtered(Resort.query)
+    total = query.order_by(None).count()
+    resorts = query.order_by(Resort.avg_score.desc(), Resort.id.desc()).offset(offset).limit(limit).all()
+    facets = {}
+    for facet in FACETS:
+        column = getattr(Resort, facet)
+        count = db.func.count(Resort.id)
+        rows = filtered(db.session.query(column, count), exclude=facet).filter(
+            column.isnot(None)
+        ).group_by(column).order_by(count.desc(), column).limit(FACET_LIMIT).all()
+        facets[facet] = [(value, n) for value, n in rows]
+    return resorts, total, facets
@@ -0,0 +1,94 @@
+"""
+Flask-Login 的用户缓存
+
+load_user 每个请求都会被调用。这里把用户的轻量信息（id、用户名、昵称、管理员标记、注册时间）
+缓存在进程内的 LRU + TTL 缓存中，命中时不访问数据库。
+User 行通过 ORM 更新或删除时立即失效；其他 worker 中的副本最多在 TTL 之后刷新。
+"""
+import threading
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from cache import MemoryCache
+from setup_db import db, User
+
+
+class CachedUser(UserMixin):
+    """current_user 使用的只读用户信息，不绑定数据库会话"""
+
+    def __init__(self, id, username, nickname, is_admin, created_at):
+        self.id = id
+        self.username = username
+        self.nickname = nickname
+        self.is_admin = is_admin
+        self.created_at = created_at
+
+
+class UserCache:
+    """带命中统计的用户缓存"""
+
+    def __init__(self, app=None):
+        self.cache = MemoryCache()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        USER_CACHE_MAX_ENTRIES: 最多缓存的用户数，默认 10000
+        USER_CACHE_TTL: 缓存秒数，默认 60
+        """
+        self.cache = MemoryCache(
+            max_entries=int(app.config.get('USER_CACHE_MAX_ENTRIES', 10000)),
+            default_ttl=int(app.config.get('USER_CACHE_TTL', 60))
+        )
+        if not event.contains(User, 'after_update', self._on_change):
+            event.listen(User, 'after_update', self._on_change)
+            event.listen(User, 'after_delete', self._on_change)
+            event.listen(db.session, 'after_commit', self._after_commit)
+        app.extensions['user_cache'] = self
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def load(self, user_id):
+        """按 id 取用户，未命中时查一次数据库；用户不存在时返回 None"""
+        user = self.cache.get(user_id)
+        if user is not None:
+            self._count('hits')
+            return user
+        self._count('misses')
+        row = db.session.query(
+            User.id, User.username, User.nickname, User.is_admin, User.created_at
+        ).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+        self.cache.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id):
+        self.cache.delete(user_id)
+        self._count('invalidations')
+
+    def _on_change(self, mapper, connection, target):
+        # flush 时先失效一次，提交后再失效一次，避免提交前被其他请求重新缓存旧值
+        self.invalidate(target.id)
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('user_cache_dirty', set()).add(target.id)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop('user_cache_dirty', ()):
+            self.invalidate(user_id)
+
+    def stats(self):
+        return [
+            ('travelhub_user_cache_hits_total', 'User loader lookups served from cache (DB queries saved).', 'counter', self.hits),
+            ('travelhub_user_cache_misses_total', 'User loader lookups that queried the database.', 'counter', self.misses),
+            ('travelhub_user_cache_invalidations_total', 'User cache entries invalidated by writes.', 'counter', self.invalidations),
+        ]
@@ -0,0 +1,293 @@
+"""
+评论的批量写入（write-behind）
+
+开启 REVIEW_WRITE_BEHIND 后，提交评论只把记录放进进程内队列并立即返回，
+后台线程在攒够 REVIEW_BATCH_SIZE 条或等待满 REVIEW_FLUSH_INTERVAL 秒后，
+用一条多行 INSERT 写入 user_resort，并在同一个事务里按度假村合并更新评分聚合，
+高峰期每条评论不再各自占用一次事务提交和一次 Resort 行锁。
+
+- 读己之写：用户还有未写入的评论时，他的下一个 GET 请求会先同步写入队列，再读取数据库。
+  队列和待写入标记都在进程内，只对落到同一个 worker 的请求有效；gunicorn 多 worker 时
+  其他 worker 上的请求最多晚一个批次间隔（REVIEW_FLUSH_INTERVAL）才能看到这条评论
+- 进程正常退出（atexit，gunicorn 发送 SIGTERM 时同样会执行）前写入剩余的评论；
+  数据库此时不可用的话，剩余评论保存到 REVIEW_SPOOL_DIR 下的 spool 文件，
+  之后任意一个 worker 收到第一个请求时重新放入队列
+- 进程被强制杀死（SIGKILL、宕机）时，最多丢失一个批次间隔内尚未写入的评论
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from flask import request
+from flask_login import current_user
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from setup_db import db, UserResort, eastern
+from ratings import record_reviews, record_user_activity
+from replicas import mark_write, use_primary
+
+SPOOL_PREFIX = 'review-spool-'
+
+
+def _transient(error):
+    """连接断开、数据库不可用、锁等待超时等与具体评论无关的错误，整批重试"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OperationalError, InterfaceError))
+
+
+class ReviewWriteBehind:
+    """评论写入队列，未开启时 submit 直接在当前请求的事务中写入"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.batch_size = 100
+        self.interval = 0.5
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self._pending = []
+        self._pending_users = {}
+        self._callbacks = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._recovered = False
+        self.spool_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        REVIEW_WRITE_BEHIND: 是否开启批量写入，默认关闭（每条评论单独提交）
+        REVIEW_BATCH_SIZE: 队列攒够多少条立即写入，默认 100
+        REVIEW_FLUSH_INTERVAL: 第一条评论入队后最多等待的秒数，默认 0.5
+        REVIEW_SPOOL_DIR: 退出时无法写入的评论保存到这个目录，默认为应用的 instance 目录
+        """
+        self.app = app
+        self.enabled = bool(app.config.get('REVIEW_WRITE_BEHIND', False))
+        self.batch_size = int(app.config.get('REVIEW_BATCH_SIZE', 100))
+        self.interval = float(app.config.get('REVIEW_FLUSH_INTERVAL', 0.5))
+        self.spool_dir = app.config.get('REVIEW_SPOOL_DIR') or app.instance_path
+        app.extensions['review_write_behind'] = self
+        if self.enabled:
+            app.before_request(self._recover_spool)
+            app.before_request(self._read_your_writes)
+            atexit.register(self.shutdown)
+
+    def on_flush(self, callback):
+        """注册写入成功后的回调，参数为本批涉及的度假村 id 集合，用于让缓存失效"""
+        self._callbacks.append(callback)
+        return callback
+
+    def submit(self, user_id, resort_id, recommendation=None, expenditure=None, comment=None):
+        """
+        提交一条评论
+
+        Returns:
+            True 表示已写入数据库，False 表示已进入队列、稍后写入
+        """
+        row = {
+            'user_id': user_id,
+            'resort_id': resort_id,
+            'created_at': datetime.now(eastern),
+            'recommendation': recommendation,
+            'expenditure': expenditure,
+            'comment': comment,
+        }
+        if not self.enabled:
+            db.session.add(UserResort(**row))
+            record_reviews(resort_id, [(recommendation, expenditure)])
+            record_user_activity({user_id: [(recommendation, expenditure)]})
+            db.session.commit()
+            self._notify({resort_id})
+            return True
+        # 写入要等批次提交，先让该用户之后的请求读主库
+        mark_write()
+        self._enqueue(row)
+        return False
+
+    def _enqueue(self, row):
+        with self._condition:
+            self._pending.append(row)
+            self._pending_users[row['user_id']] = self._pending_users.get(row['user_id'], 0) + 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='review-write-behind', daemon=True)
+                self._thread.start()
+            # 第一条唤醒空闲的后台线程开始计时，攒满一批时不再等待
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def has_pending(self, user_id):
+        """该用户是否还有尚未写入（或正在写入）的评论"""
+        with self._condition:
+            return self._pending_users.get(user_id, 0) > 0
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _read_your_writes(self):
+        # 只有读请求需要看到自己的评论；队列为空时不读取 current_user，避免给每个请求增加开销
+        if request.method not in ('GET', 'HEAD') or not self._pending_users:
+            return
+        if current_user.is_authenticated and self.has_pending(current_user.id):
+            self.flush()
+            use_primary()
+
+    def flush(self):
+        """同步写入队列中的全部评论，返回写入的条数"""
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            written, retry = self._write(batch)
+            if retry:
+                # 数据库暂时不可用：未写入的部分放回队首，下个周期重试
+                with self._condition:
+                    self._pending[:0] = retry
+            with self._condition:
+                for row in batch[:len(batch) - len(retry)]:
+                    remaining = self._pending_users.get(row['user_id'], 0) - 1
+                    if remaining > 0:
+                        self._pending_users[row['user_id']] = remaining
+                    else:
+                        self._pending_users.pop(row['user_id'], None)
+            return written
+
+    def _write(self, batch):
+        """
+        Returns:
+            (写入的条数, 需要重试的评论)，需要重试的总是 batch 末尾的一段
+        """
+        with self.app.app_context():
+            try:
+                self._insert(batch)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                if _transient(e):
+                    print(f"评论批量写入失败，{len(batch)} 条将重试: {e}")
+                    return 0, batch
+                # 个别评论无法写入（引用的度假村或用户已被删除、取值超出范围等）：逐条写入，丢弃失败的那几条
+                return self._write_each(batch)
+            self.written += len(batch)
+            self.batches += 1
+            self._notify({row['resort_id'] for row in batch})
+        return len(batch), []
+
+    def _write_each(self, batch):
+        written, retry = [], []
+        for index, row in enumerate(batch):
+            try:
+                self._insert([row])
+                db.session.commit()
+                written.append(row)
+            except Exception as e:
+                db.session.rollback()
+                if _transient(e):
+                    retry = batch[index:]
+                    print(f"评论逐条写入失败，{len(retry)} 条将重试: {e}")
+                    break
+                self.dropped += 1
+                print(f"丢弃无法写入的评论 user={row['user_id']} resort={row['resort_id']}: {getattr(e, 'orig', e)}")
+        self.written += len(written)
+        self.batches += 1
+        if written:
+            self._notify({row['resort_id'] for row in written})
+        return len(written), retry
+
+    def _insert(self, rows):
+        db.session.execute(db.insert(UserResort), rows)
+        by_resort, by_user = {}, {}
+        for row in rows:
+            review = (row['recommendation'], row['expenditure'])
+            by_resort.setdefault(row['resort_id'], []).append(review)
+            by_user.setdefault(row['user_id'], []).append(review)
+        # 按 id 顺序加行锁，多个 worker 同时写入时不会互相死锁
+        for resort_id in sorted(by_resort):
+            record_reviews(resort_id, by_resort[resort_id])
+        record_user_activity(by_user)
+
+    def _notify(self, resort_ids):
+        for callback in self._callbacks:
+            callback(resort_ids)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.interval)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def shutdown(self):
+        """停止后台线程并写入剩余的评论，写入失败的保存到 spool 文件"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        self.flush()
+        with self._flush_lock, self._condition:
+            rows, self._pending = self._pending, []
+        if rows:
+            self._spool(rows)
+
+    def _spool(self, rows):
+        path = os.path.join(self.spool_dir, f"{SPOOL_PREFIX}{os.getpid()}-{int(time.time())}.jsonl")
+        lines = [json.dumps(dict(row, created_at=row['created_at'].isoformat()), ensure_ascii=False) for row in rows]
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            # 先写临时文件再改名，其他 worker 不会领取写了一半的文件
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"无法保存 spool 文件 {path}: {e}，以下 {len(rows)} 条评论丢失")
+            for line in lines:
+                print(f"丢失的评论: {line}")
+            return
+        print(f"{len(rows)} 条评论未能写入数据库，已保存到 {path}")
+
+    def _recover_spool(self):
+        """把之前退出时保存的评论重新放入队列，每个进程只检查一次"""
+        if self._recovered:
+            return
+        self._recovered = True
+        try:
+            names = sorted(os.listdir(self.spool_dir))
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not (name.startswith(SPOOL_PREFIX) and name.endswith('.jsonl')):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            claimed = f"{path}.{os.getpid()}"
+            try:
+                # 改名成功的 worker 负责这个文件，其他 worker 跳过
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            for row in rows:
+                row['created_at'] = datetime.fromisoformat(row['created_at'])
+                self._enqueue(row)
+            os.remove(claimed)
+            print(f"从 {path} 恢复 {len(rows)} 条评论")
+
+    def stats(self):
+        return [
+            ('travelhub_review_queue_pending', 'Reviews accepted but not yet written.', 'gauge', self.pending_count()),
+            ('travelhub_review_queue_written_total', 'Reviews written by the write-behind queue.', 'counter', self.written),
+            ('travelhub_review_queue_batches_total', 'Write-behind batches committed.', 'counter', self.batches),
+            ('travelhub_review_queue_dropped_total', 'Queued reviews dropped because they could not be written.', 'counter', self.dropped),
+        ]